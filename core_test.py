@@ -11,13 +11,13 @@ from run_telegram import run_telegram_bot
 from utils.check_usage import ACTIVE_USERS, check_ip_used, run_check_users_usage
 from utils.get_logs import (
     TASKS,
-    check_and_add_new_nodes,
     create_node_task,
     create_panel_task,
-    handle_cancel,
     handle_cancel_one,
+    handle_node_events,
 )
-from utils.handel_dis_users import DisabledUsers
+from utils.handel_dis_users import get_disabled_users
+from utils.node_inventory import NODE_INVENTORY, diff_nodes
 from utils.panel_api import (
     all_user,
     disable_user,
@@ -27,7 +27,14 @@ from utils.panel_api import (
     get_nodes,
     get_token,
 )
-from utils.parse_logs import INVALID_EMAILS, check_ip, parse_logs
+from utils.parse_logs import (
+    CACHE,
+    INVALID_EMAILS,
+    VALID_IPS,
+    check_ip,
+    parse_logs,
+    record_ip,
+)
 from utils.read_config import read_config
 from utils.types import PanelType, UserType
 
@@ -41,7 +48,7 @@ users = [
     UserType(name="Test"),
 ]
 INVALID_EMAILS.append("Irancell")
-dis_obj = DisabledUsers()
+dis_obj = get_disabled_users()
 
 LOGS = """
 2023/07/07 03:08:59 [2a01:5ec0:5011:9962:d8ed:c723:c32:ac2a]:62316 accepted tcp:2.56.98.255:8000 [GRPC 6 >> DIRECT] email: 6.TEST_user+canyoudetec-t=me
@@ -84,21 +91,11 @@ LOGS = """
 
 async def add_fake_users():
     """Add some fake users to test"""
-    ACTIVE_USERS.setdefault("user_name", UserType(name="user_name", ip=["9.9.9.9"]))
-    ACTIVE_USERS["user_name"].ip.append("8.8.8.8")
-    ACTIVE_USERS["user_name"].ip.append("8.8.8.8")
-    ACTIVE_USERS["user_name"].ip.append("8.8.8.8")
-    ACTIVE_USERS["user_name"].ip.append("1.1.1.1")
-    ACTIVE_USERS["user_name"].ip.append("1.1.1.1")
-    ACTIVE_USERS["user_name"].ip.append("1.1.1.1")
-    ACTIVE_USERS.setdefault(
-        "another_user",
-        UserType(name="another_user", ip=["1.1.1.2"]),
-    )
-    ACTIVE_USERS["another_user"].ip.append("1.1.1.2")
-    ACTIVE_USERS["another_user"].ip.append("1.1.1.2")
-    ACTIVE_USERS["another_user"].ip.append("1.1.1.2")
-    ACTIVE_USERS.setdefault("test", UserType(name="test", ip=["..."]))
+    record_ip("user_name", "9.9.9.9")
+    record_ip("user_name", "8.8.8.8", 3)
+    record_ip("user_name", "1.1.1.1", 3)
+    record_ip("another_user", "1.1.1.2", 4)
+    record_ip("test", "...")
 
 
 async def main():  # pylint: disable=too-many-statements
@@ -112,6 +109,7 @@ async def main():  # pylint: disable=too-many-statements
     await check_ip_used()
     print("Print All Active Users After 'check_ip_used' Test: ", ACTIVE_USERS)
     print("Parser Test: ", await parse_logs(LOGS))
+    print("IP Cache Stats Test: ", VALID_IPS.stats(), CACHE.stats())
     print("Check Ip Test: ", await check_ip("2a01:5ec0:5011:9962:d8ed:c723:c32:ac2a"))
     try:
         print("Get Token Test: ", await get_token(panel_data))
@@ -168,16 +166,18 @@ async def main():  # pylint: disable=too-many-statements
                 await create_node_task(panel_data, tg, node)
                 await asyncio.sleep(2)
             await asyncio.sleep(20)
+            print(
+                "Diff Nodes Test: ", diff_nodes({}, {n.node_id: n for n in nodes_list})
+            )
             # pylint: disable=duplicate-code
-            print("Start 'check_and_add_new_nodes' Task Test: ")
+            print("Start 'handle_node_events' Task Test: ")
             tg.create_task(
-                check_and_add_new_nodes(panel_data, tg),
-                name="add_new_nodes",
+                handle_node_events(panel_data, tg),
+                name="node_streams",
             )
-            print("Start 'handle_cancel' Task Test: ")
             tg.create_task(
-                handle_cancel(panel_data, TASKS),
-                name="cancel_disable_nodes",
+                NODE_INVENTORY.run(panel_data),
+                name="node_inventory",
             )
         tg.create_task(
             enable_dis_user(panel_data),
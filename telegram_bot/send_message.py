@@ -1,24 +1,274 @@
 """
 Send logs to telegram bot.
+
+The messages are queued and sent by a background dispatcher, so a slow or
+rate limited Telegram API doesn't slow down the callers of send_logs().
 """
 
+# pylint: disable=global-statement
+
+import asyncio
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
 from telegram_bot.main import application
 from telegram_bot.utils import check_admin
+from utils.logs import logger
 
+MAX_MESSAGE_LENGTH = 4096
+QUEUE_SIZE = 1000
+# messages queued within this many seconds are merged into one
+MERGE_WINDOW = 1.0
+# Telegram allows about one message per second in a chat and 30 in total
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+GLOBAL_RATE = 30.0
+# seconds to send the queued messages when the dispatcher stops
+FLUSH_TIMEOUT = 10
+# set in the ingest worker processes, send_logs() passes the messages to it
+FORWARD = None
 
-async def send_logs(msg):
-    """Send logs to all admins."""
-    admins = await check_admin()
-    retries = 2
-    if admins:
-        for admin in admins:
-            for _ in range(retries):
-                try:
-                    await application.bot.sendMessage(
-                        chat_id=admin, text=msg, parse_mode="HTML"
+
+class TokenBucket:
+    """
+    A token bucket rate limiter.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        capacity (float): The maximum number of tokens (the allowed burst).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Take a token and return how many seconds to wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self) -> None:
+        """Wait until a token is available."""
+        delay = self.delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def group_messages(messages: list[str]) -> list[list[str]]:
+    """
+    Group messages so each group joined with blank lines is up to 4096 characters.
+    A message that is longer than that is split at line breaks (or cut).
+
+    Args:
+        messages (list[str]): The messages.
+
+    Returns:
+        list[list[str]]: The groups, each one is sent as one message.
+    """
+    groups = []
+    current = []
+    length = 0
+    for message in messages:
+        while len(message) > MAX_MESSAGE_LENGTH:
+            if current:
+                groups.append(current)
+                current, length = [], 0
+            cut = message.rfind("\n", 0, MAX_MESSAGE_LENGTH)
+            cut = cut if cut > 0 else MAX_MESSAGE_LENGTH
+            groups.append([message[:cut]])
+            message = message[cut:].lstrip("\n")
+        if current and length + 2 + len(message) <= MAX_MESSAGE_LENGTH:
+            current.append(message)
+            length += 2 + len(message)
+        else:
+            if current:
+                groups.append(current)
+            current = [message]
+            length = len(message)
+    if current:
+        groups.append(current)
+    return groups
+
+
+def merge_messages(messages: list[str]) -> list[str]:
+    """
+    Join messages into as few messages as possible, each up to 4096 characters.
+
+    Args:
+        messages (list[str]): The messages.
+
+    Returns:
+        list[str]: The merged messages.
+    """
+    return ["\n\n".join(group) for group in group_messages(messages)]
+
+
+class NotificationDispatcher:
+    """
+    Sends the queued messages to all admins.
+
+    Messages queued close together are merged, each admin chat has its own
+    token bucket (and there is one for the bot) and the admins are sent to
+    concurrently. If the queue is full the oldest message is dropped.
+    If Telegram rejects a merged message (like invalid HTML in one of them),
+    its messages are sent one by one, and a rejected one is sent as plain text.
+    The messages still queued when the dispatcher stops are sent before it returns.
+    """
+
+    def __init__(self, maxsize: int = QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._queue: asyncio.Queue | None = None
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+
+    @property
+    def running(self) -> bool:
+        """True if run() is running and messages are queued."""
+        return self._queue is not None
+
+    def submit(self, msg: str) -> None:
+        """
+        Queue a message.
+
+        Args:
+            msg (str): The message (HTML).
+        """
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(msg)
+
+    async def _send_to_admin(
+        self, admin: int, msg: str, retries: int = 2, parse_mode: str | None = "HTML"
+    ) -> None:
+        """Send a message to an admin, BadRequest is raised to the caller."""
+        bucket = self._chat_buckets.setdefault(
+            admin, TokenBucket(CHAT_RATE, CHAT_BURST)
+        )
+        for _ in range(retries):
+            await bucket.acquire()
+            await self._global_bucket.acquire()
+            try:
+                await application.bot.sendMessage(
+                    chat_id=admin, text=msg, parse_mode=parse_mode
+                )
+                return
+            except BadRequest:
+                raise
+            except RetryAfter as error:
+                retry_after = error.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                await asyncio.sleep(retry_after)
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Failed to send message to admin {admin}: {e}")
+
+    async def _deliver(self, admin: int, parts: list[str]) -> None:
+        """Send merged messages to an admin, one by one if Telegram rejects them."""
+        try:
+            await self._send_to_admin(admin, "\n\n".join(parts))
+        except BadRequest as error:
+            if len(parts) > 1:
+                for part in parts:
+                    await self._deliver(admin, [part])
+                return
+            logger.warning("Telegram rejected a message, sent as plain text: %s", error)
+            try:
+                await self._send_to_admin(admin, parts[0], parse_mode=None)
+            except BadRequest as plain_error:
+                print(f"Failed to send message to admin {admin}: {plain_error}")
+
+    async def send(self, msg: str | list[str]) -> None:
+        """
+        Send a message to all admins now.
+
+        Args:
+            msg (str | list[str]): The message (HTML), or messages to merge into one.
+        """
+        parts = [msg] if isinstance(msg, str) else msg
+        admins = await check_admin()
+        if admins:
+            await asyncio.gather(*(self._deliver(admin, parts) for admin in admins))
+        else:
+            print("No admins found.")
+
+    async def _flush(self, messages: list[str], timeout: float) -> None:
+        """Send the messages left when run() stops, giving up after 'timeout' seconds."""
+        try:
+            async with asyncio.timeout(timeout):
+                for group in group_messages(messages):
+                    await self.send(group)
+        except TimeoutError:
+            logger.warning("Failed to send %s queued messages in time", len(messages))
+
+    async def run(self) -> None:
+        """Merge and send the queued messages."""
+        self._queue = asyncio.Queue(self.maxsize)
+        messages = []
+        try:
+            while True:
+                messages = [await self._queue.get()]
+                deadline = time.monotonic() + MERGE_WINDOW
+                while (timeout := deadline - time.monotonic()) > 0:
+                    # wait_for() of Python 3.11 can lose the cancellation of the task
+                    try:
+                        async with asyncio.timeout(timeout):
+                            messages.append(await self._queue.get())
+                    except TimeoutError:
+                        break
+                if self.dropped:
+                    logger.warning(
+                        "Dropped %s messages, the notification queue was full",
+                        self.dropped,
                     )
-                    break
-                except Exception as e:  # pylint: disable=broad-except
-                    print(f"Failed to send message to admin {admin}: {e}")
+                    messages.append(
+                        f"<i>{self.dropped} older messages were dropped</i>"
+                    )
+                    self.dropped = 0
+                groups = group_messages(messages)
+                for index, group in enumerate(groups):
+                    await self.send(group)
+                    messages = [part for rest in groups[index + 1 :] for part in rest]
+        finally:
+            # the last messages are often the error that stopped the other tasks
+            while not self._queue.empty():
+                messages.append(self._queue.get_nowait())
+            self._queue = None
+            if messages:
+                try:
+                    await asyncio.shield(self._flush(messages, FLUSH_TIMEOUT))
+                except asyncio.CancelledError:
+                    pass
+
+
+DISPATCHER = NotificationDispatcher()
+
+
+def forward_logs(callback) -> None:
+    """
+    Pass the messages of send_logs() to a callback instead of sending them,
+    used by the ingest workers to send them through the main process.
+
+    Args:
+        callback (Callable[[str], Awaitable] | None): Receives each message,
+            None to send them again.
+    """
+    global FORWARD
+    FORWARD = callback
+
+
+async def send_logs(msg):
+    """Send logs to all admins (queued if the dispatcher is running)."""
+    if FORWARD is not None:
+        await FORWARD(msg)
+    elif DISPATCHER.running:
+        DISPATCHER.submit(msg)
     else:
-        print("No admins found.")
+        await DISPATCHER.send(msg)
@@ -3,18 +3,23 @@ This module contains utility functions for reading and writing to a JSON file,
 managing admin IDs, and handling special limits for users and more...
 """
 
+import asyncio
+import copy
 import json
 import os
-import sys
-
+from typing import Any, Callable
+
+from utils.http_client import get_panel_client
+from utils.loop_lock import LoopLock
+from utils.read_config import (
+    CONFIG_FILE,
+    cached_config,
+    invalidate_config,
+    read_config,
+    refresh_config,
+)
 from utils.types import PanelType
 
-try:
-    import httpx
-except ImportError:
-    print("Module 'httpx' is not installed use: 'pip install httpx' to install it")
-    sys.exit()
-
 
 async def get_token(panel_data: PanelType) -> PanelType | ValueError:
     """
@@ -28,9 +33,8 @@ async def get_token(panel_data: PanelType) -> PanelType | ValueError:
     for scheme in ["https", "http"]:
         url = f"{scheme}://{panel_data.panel_domain}/api/admin/token"
         try:
-            async with httpx.AsyncClient(verify=False) as client:
-                response = await client.post(url, data=payload, timeout=5)
-                response.raise_for_status()
+            response = await get_panel_client().post(url, data=payload, timeout=5)
+            response.raise_for_status()
             json_obj = response.json()
             panel_data.panel_token = json_obj["access_token"]
             return panel_data
@@ -43,6 +47,68 @@ async def get_token(panel_data: PanelType) -> PanelType | ValueError:
     raise ValueError(message)
 
 
+class ConfigRepository:
+    """
+    Serialises the changes to config.json.
+
+    It keeps no copy of its own: reads return the data cached by read_config()
+    (kept up to date by watch_config()), so the process has one cached config.
+    Changes are made under one lock, written to a temporary file from a worker
+    thread, renamed over config.json and published as a new config snapshot.
+    """
+
+    def __init__(self, filename: str = CONFIG_FILE):
+        self.filename = filename
+        self._lock = LoopLock()
+
+    def _write(self, data: dict) -> None:
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, self.filename)
+
+    def exists(self) -> bool:
+        """Return True if the config file exists (or was already read)."""
+        return cached_config() is not None or os.path.exists(self.filename)
+
+    async def read(self) -> dict:
+        """
+        Return the config data of read_config().
+        The returned dict is shared, it must not be changed (use update()).
+
+        Returns:
+            dict: The config data ({} if the file does not exist).
+        """
+        if not self.exists():
+            return {}
+        return await read_config()
+
+    async def update(self, change: Callable[[dict], Any]) -> Any:
+        """
+        Change the config data and save it (only if it was changed).
+
+        Args:
+            change (Callable[[dict], Any]): Changes the given copy of the data in place.
+
+        Returns:
+            Any: What 'change' returned.
+        """
+        async with self._lock.get():
+            current = await self.read()
+            data = copy.deepcopy(current)
+            result = change(data)
+            if data != current or not os.path.exists(self.filename):
+                await asyncio.to_thread(self._write, data)
+                invalidate_config()
+                await refresh_config()
+            return result
+
+
+CONFIG_REPOSITORY = ConfigRepository()
+
+
 async def read_json_file() -> dict:
     """
     Reads and returns the content of the config.json file.
@@ -50,8 +116,7 @@ async def read_json_file() -> dict:
     Returns:
         The content of the config.json file.
     """
-    with open("config.json", "r", encoding="utf-8") as f:
-        return json.load(f)
+    return copy.deepcopy(await CONFIG_REPOSITORY.read())
 
 
 async def write_json_file(data: dict):
@@ -61,8 +126,12 @@ async def write_json_file(data: dict):
     Args:
         data: The data to write to the file.
     """
-    with open("config.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+
+    def replace(current: dict) -> None:
+        current.clear()
+        current.update(data)
+
+    await CONFIG_REPOSITORY.update(replace)
 
 
 async def add_admin_to_config(new_admin_id: int) -> int | None:
@@ -75,19 +144,15 @@ async def add_admin_to_config(new_admin_id: int) -> int | None:
     Returns:
         The ID of the new admin if it was added, None otherwise.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        admins = data.get("ADMINS", [])
-        if int(new_admin_id) not in admins:
-            admins.append(int(new_admin_id))
-            data["ADMINS"] = admins
-            await write_json_file(data)
-            return new_admin_id
-    else:
-        data = {"ADMINS": [new_admin_id]}
-        await write_json_file(data)
+
+    def add(data: dict) -> int | None:
+        admins = data.setdefault("ADMINS", [])
+        if int(new_admin_id) in admins:
+            return None
+        admins.append(int(new_admin_id))
         return new_admin_id
-    return None
+
+    return await CONFIG_REPOSITORY.update(add)
 
 
 async def check_admin() -> list[int] | None:
@@ -97,9 +162,10 @@ async def check_admin() -> list[int] | None:
     Returns:
         The list of admins.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
+    data = await CONFIG_REPOSITORY.read()
+    if data:
         return data.get("ADMINS", [])
+    return None
 
 
 async def handel_special_limit(username: str, limit: int) -> list:
@@ -114,19 +180,14 @@ async def handel_special_limit(username: str, limit: int) -> list:
         A list where the first element is a flag indicating whether the limit was set before,
         and the second element is the new limit.
     """
-    set_before = 0
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        special_limit = data.get("SPECIAL_LIMIT", {})
-        if special_limit.get(username):
-            set_before = 1
+
+    def set_limit(data: dict) -> list:
+        special_limit = data.setdefault("SPECIAL_LIMIT", {})
+        set_before = 1 if special_limit.get(username) else 0
         special_limit[username] = limit
-        data["SPECIAL_LIMIT"] = special_limit
-        await write_json_file(data)
-        return [set_before, special_limit[username]]
-    data = {"SPECIAL_LIMIT": {username: limit}}
-    await write_json_file(data)
-    return [0, special_limit[username]]
+        return [set_before, limit]
+
+    return await CONFIG_REPOSITORY.update(set_limit)
 
 
 async def remove_admin_from_config(admin_id: int) -> bool:
@@ -139,14 +200,15 @@ async def remove_admin_from_config(admin_id: int) -> bool:
     Returns:
         bool: True if the admin was successfully removed, False otherwise.
     """
-    data = await read_json_file()
-    admins = data.get("ADMINS", [])
-    if admin_id in admins:
-        admins.remove(admin_id)
-        data["ADMINS"] = admins
-        await write_json_file(data)
-        return True
-    return False
+
+    def remove(data: dict) -> bool:
+        admins = data.get("ADMINS", [])
+        if admin_id in admins:
+            admins.remove(admin_id)
+            return True
+        return False
+
+    return await CONFIG_REPOSITORY.update(remove)
 
 
 async def add_base_information(domain: str, password: str, username: str):
@@ -164,18 +226,15 @@ async def add_base_information(domain: str, password: str, username: str):
     await get_token(
         PanelType(panel_domain=domain, panel_password=password, panel_username=username)
     )
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-    else:
-        data = {}
-    data.update(
-        {
-            "PANEL_DOMAIN": domain,
-            "PANEL_USERNAME": username,
-            "PANEL_PASSWORD": password,
-        }
+    await CONFIG_REPOSITORY.update(
+        lambda data: data.update(
+            {
+                "PANEL_DOMAIN": domain,
+                "PANEL_USERNAME": username,
+                "PANEL_PASSWORD": password,
+            }
+        )
     )
-    await write_json_file(data)
 
 
 async def get_special_limit_list() -> list | None:
@@ -186,20 +245,18 @@ async def get_special_limit_list() -> list | None:
     Returns:
         list
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        special_list = data.get("SPECIAL_LIMIT", None)
-        if not special_list:
-            return None
-        special_list = "\n".join(
-            [f"{key} : {value}" for key, value in special_list.items()]
-        )
-        messages = special_list.split("\n")
-        shorter_messages = [
-            "\n".join(messages[i : i + 100]) for i in range(0, len(messages), 100)
-        ]
-        return shorter_messages
-    return None
+    data = await CONFIG_REPOSITORY.read()
+    special_list = data.get("SPECIAL_LIMIT", None)
+    if not special_list:
+        return None
+    special_list = "\n".join(
+        [f"{key} : {value}" for key, value in special_list.items()]
+    )
+    messages = special_list.split("\n")
+    shorter_messages = [
+        "\n".join(messages[i : i + 100]) for i in range(0, len(messages), 100)
+    ]
+    return shorter_messages
 
 
 async def write_country_code_json(country_code: str) -> None:
@@ -209,9 +266,9 @@ async def write_country_code_json(country_code: str) -> None:
     Args:
         country_code: The country code to write to the file.
     """
-    data = await read_json_file()
-    data["IP_LOCATION"] = country_code
-    await write_json_file(data)
+    await CONFIG_REPOSITORY.update(
+        lambda data: data.update({"IP_LOCATION": country_code})
+    )
 
 
 async def add_except_user(except_user: str) -> str | None:
@@ -219,19 +276,15 @@ async def add_except_user(except_user: str) -> str | None:
     Add a user to the exception list in the config file.
     If the config file does not exist, it creates one.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        user = data.get("EXCEPT_USERS", [])
-        if except_user not in user:
-            user.append(except_user)
-            data["EXCEPT_USERS"] = user
-            await write_json_file(data)
-            return except_user
-    else:
-        data = {"EXCEPT_USERS": [except_user]}
-        await write_json_file(data)
+
+    def add(data: dict) -> str | None:
+        users = data.setdefault("EXCEPT_USERS", [])
+        if except_user in users:
+            return None
+        users.append(except_user)
         return except_user
-    return None
+
+    return await CONFIG_REPOSITORY.update(add)
 
 
 async def show_except_users_handler() -> list | None:
@@ -239,32 +292,31 @@ async def show_except_users_handler() -> list | None:
     Retrieve the list of exception users from the config file.
     If the list is too long, it splits the list into shorter messages.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        except_users = data.get("EXCEPT_USERS", None)
-        if not except_users:
-            return None
-        except_users = "\n".join([f"{key}" for key in except_users])
-        messages = except_users.split("\n")
-        shorter_messages = [
-            "\n".join(messages[i : i + 100]) for i in range(0, len(messages), 100)
-        ]
-        return shorter_messages
-    return None
+    data = await CONFIG_REPOSITORY.read()
+    except_users = data.get("EXCEPT_USERS", None)
+    if not except_users:
+        return None
+    except_users = "\n".join([f"{key}" for key in except_users])
+    messages = except_users.split("\n")
+    shorter_messages = [
+        "\n".join(messages[i : i + 100]) for i in range(0, len(messages), 100)
+    ]
+    return shorter_messages
 
 
 async def remove_except_user_from_config(user: str) -> str | None:
     """
     Remove a user from the exception list in the config file.
     """
-    data = await read_json_file()
-    except_user = data.get("EXCEPT_USERS", [])
-    if user in except_user:
-        except_user.remove(user)
-        data["EXCEPT_USERS"] = except_user
-        await write_json_file(data)
-        return user
-    return None
+
+    def remove(data: dict) -> str | None:
+        except_user = data.get("EXCEPT_USERS", [])
+        if user in except_user:
+            except_user.remove(user)
+            return user
+        return None
+
+    return await CONFIG_REPOSITORY.update(remove)
 
 
 async def save_general_limit(limit: int) -> int:
@@ -272,13 +324,7 @@ async def save_general_limit(limit: int) -> int:
     Save the general limit to the config file.
     If the config file does not exist, it creates one.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        data["GENERAL_LIMIT"] = limit
-        await write_json_file(data)
-        return limit
-    data = {"GENERAL_LIMIT": limit}
-    await write_json_file(data)
+    await CONFIG_REPOSITORY.update(lambda data: data.update({"GENERAL_LIMIT": limit}))
     return limit
 
 
@@ -287,13 +333,9 @@ async def save_check_interval(interval: int) -> int:
     Save the check interval to the config file.
     If the config file does not exist, it creates one.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        data["CHECK_INTERVAL"] = interval
-        await write_json_file(data)
-        return interval
-    data = {"CHECK_INTERVAL": interval}
-    await write_json_file(data)
+    await CONFIG_REPOSITORY.update(
+        lambda data: data.update({"CHECK_INTERVAL": interval})
+    )
     return interval
 
 
@@ -302,11 +344,7 @@ async def save_time_to_active_users(time: int) -> int:
     Save the time to active users to the config file.
     If the config file does not exist, it creates one.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        data["TIME_TO_ACTIVE_USERS"] = time
-        await write_json_file(data)
-        return time
-    data = {"TIME_TO_ACTIVE_USERS": time}
-    await write_json_file(data)
+    await CONFIG_REPOSITORY.update(
+        lambda data: data.update({"TIME_TO_ACTIVE_USERS": time})
+    )
     return time
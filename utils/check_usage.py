@@ -1,32 +1,42 @@
 """
 This module checks if a user (name and IP address)
-appears more than two times in the ACTIVE_USERS list.
+appears more than two times in the ACTIVE_USERS sliding window.
 """
 
+# pylint: disable=global-statement
+
 import asyncio
-from collections import Counter
+import heapq
+import time
+from collections.abc import Mapping
 
 from telegram_bot.send_message import send_logs
+from utils.handel_dis_users import DISABLED_USERS
+from utils.ip_tracker import IpTracker
 from utils.logs import logger
 from utils.panel_api import disable_user
-from utils.read_config import read_config
-from utils.types import PanelType, UserType
+from utils.read_config import read_config, refresh_config, subscribe_config
+from utils.types import ConfigSnapshot, LimitIndex, PanelType, UserType
 
-ACTIVE_USERS: dict[str, UserType] | dict = {}
+ACTIVE_USERS = IpTracker()
+DEFAULT_DISABLE_CONCURRENCY = 10
+DEFAULT_DISABLE_TIMEOUT = 60
+DEFAULT_ENFORCE_DEBOUNCE = 5
+# users that failed to be disabled are checked again after this many seconds
+ENFORCE_RETRY_DELAY = 30
+# the limit of each user, rebuilt by apply_config() when the config changes
+LIMITS = LimitIndex()
 
 
 async def check_ip_used() -> dict:
     """
     This function checks if a user (name and IP address)
-    appears more than two times in the ACTIVE_USERS list.
+    appears more than two times in the ACTIVE_USERS sliding window.
     """
     all_users_log = {}
-    for email in list(ACTIVE_USERS.keys()):
-        data = ACTIVE_USERS[email]
-        ip_counts = Counter(data.ip)
-        data.ip = list({ip for ip in data.ip if ip_counts[ip] > 2})
-        all_users_log[email] = data.ip
-        logger.info(data)
+    for email, ips in ACTIVE_USERS.active_users().items():
+        all_users_log[email] = sorted(ips)
+        logger.info("%s: %s", email, all_users_log[email])
     total_ips = sum(len(ips) for ips in all_users_log.values())
     all_users_log = dict(
         sorted(
@@ -52,31 +62,253 @@ async def check_ip_used() -> dict:
     return all_users_log
 
 
-async def check_users_usage(panel_data: PanelType):
+async def disable_users(
+    panel_data: PanelType,
+    usernames: list[str],
+    concurrency: int = DEFAULT_DISABLE_CONCURRENCY,
+    timeout: float = DEFAULT_DISABLE_TIMEOUT,
+) -> dict[str, bool]:
+    """
+    Disable users concurrently with a bounded number of workers.
+
+    Args:
+        panel_data (PanelType): The credentials for the panel.
+        usernames (list[str]): The users to disable.
+        concurrency (int): How many users are disabled at the same time.
+        timeout (float): Seconds to wait for each user before giving up.
+
+    Returns:
+        dict[str, bool]: The result for each user, True if the user was disabled.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def disable_one(username: str) -> tuple[str, bool]:
+        async with semaphore:
+            try:
+                await asyncio.wait_for(
+                    disable_user(panel_data, UserType(name=username)),
+                    timeout,
+                )
+                return username, True
+            except ValueError as error:
+                logger.error(error)
+            except asyncio.TimeoutError:
+                logger.error(
+                    "Disabling user %s timed out after %s seconds", username, timeout
+                )
+            return username, False
+
+    results = await asyncio.gather(*(disable_one(name) for name in usernames))
+    return dict(results)
+
+
+async def warn_user(user_name: str, user_ip: set[str] | list[str]) -> None:
+    """Send a warning about a user that passed its limit."""
+    message = (
+        f"User {user_name} has {str(len(set(user_ip)))}"
+        + f" active ips. {str(set(user_ip))}"
+    )
+    logger.warning(message)
+    await send_logs(str("<b>Warning: </b>" + message))
+
+
+async def disable_and_report(
+    panel_data: PanelType, config_data: Mapping, users_to_disable: list[str]
+) -> dict[str, bool]:
+    """
+    Disable the users that passed their limit and send a summary.
+
+    Args:
+        panel_data (PanelType): The credentials for the panel.
+        config_data (Mapping): The config data.
+        users_to_disable (list[str]): The users to disable.
+
+    Returns:
+        dict[str, bool]: The result for each user, True if the user was disabled.
+    """
+    results = await disable_users(
+        panel_data,
+        users_to_disable,
+        int(config_data.get("DISABLE_CONCURRENCY", DEFAULT_DISABLE_CONCURRENCY)),
+        float(config_data.get("DISABLE_TIMEOUT", DEFAULT_DISABLE_TIMEOUT)),
+    )
+    failed = []
+    for name, disabled in results.items():
+        if disabled:
+            # start over, the old connections shouldn't disable it again
+            ACTIVE_USERS.reset(name)
+        else:
+            failed.append(name)
+    message = f"Disabled <b>{len(results) - len(failed)}</b> of {len(results)} users"
+    if failed:
+        message += "\nFailed to disable:\n- " + "\n- ".join(
+            f"<code>{name}</code>" for name in failed
+        )
+    logger.info(message)
+    await send_logs(message)
+    return results
+
+
+class Enforcer:
+    """
+    Disables users as soon as they pass their limit, instead of waiting for
+    the next 'CHECK_INTERVAL' pass (enabled with 'INSTANT_ENFORCEMENT' in the config).
+
+    ACTIVE_USERS calls notify() whenever a user gets a new active IP.
+    A user over its limit is queued once and checked again after 'ENFORCE_DEBOUNCE'
+    seconds, it is only disabled if it is still over the limit then.
+    It can't be queued again until that check is done (or it is disabled and its
+    window is reset), so a count going up and down around the limit is handled once.
+    Users that fail to be disabled are queued again after 'ENFORCE_RETRY_DELAY' seconds,
+    and the periodic pass passes every user to notify() too (for lowered limits).
+    """
+
+    def __init__(self, debounce: float = DEFAULT_ENFORCE_DEBOUNCE):
+        self.enabled = False
+        self.debounce = debounce
+        self.config_data: dict = {}
+        # username -> time.monotonic() when it is checked
+        self.pending: dict[str, float] = {}
+        # (check time, username) of the pending users
+        self._heap: list[tuple[float, str]] = []
+        self._wakeup: asyncio.Event | None = None
+
+    def configure(self, config_data: dict) -> None:
+        """Take the enforcement settings from the config data."""
+        self.config_data = config_data
+        self.enabled = bool(config_data.get("INSTANT_ENFORCEMENT", False))
+        self.debounce = float(
+            config_data.get("ENFORCE_DEBOUNCE", DEFAULT_ENFORCE_DEBOUNCE)
+        )
+
+    @staticmethod
+    def over_limit(email: str, active_ips: int) -> bool:
+        """Return True if the user has more active IPs than LIMITS allows."""
+        limit = LIMITS.limit(email)
+        return limit is not None and active_ips > limit
+
+    def notify(self, email: str, active_ips: int) -> None:
+        """
+        Called by ACTIVE_USERS when a user gets a new active IP.
+
+        Args:
+            email (str): The username.
+            active_ips (int): The number of active IPs of the user.
+        """
+        if not self.enabled or self._wakeup is None or email in self.pending:
+            return
+        if email in DISABLED_USERS or not self.over_limit(email, active_ips):
+            return
+        self._schedule(email, self.debounce)
+
+    def _schedule(self, email: str, delay: float) -> None:
+        """Check a user again after 'delay' seconds."""
+        due = time.monotonic() + delay
+        self.pending[email] = due
+        heapq.heappush(self._heap, (due, email))
+        self._wakeup.set()
+
+    async def run(self, panel_data: PanelType) -> None:
+        """
+        Disable the queued users when their debounce time is over.
+
+        Args:
+            panel_data (PanelType): The credentials for the panel.
+        """
+        self._wakeup = asyncio.Event()
+        self._heap.clear()
+        self.pending.clear()
+        try:
+            while True:
+                self._wakeup.clear()
+                if not self._heap:
+                    await self._wakeup.wait()
+                    continue
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    # a retry can be queued before the first user
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                now = time.monotonic()
+                batch = []
+                while self._heap and self._heap[0][0] <= now:
+                    batch.append(heapq.heappop(self._heap)[1])
+                await self._enforce(panel_data, batch)
+        finally:
+            self._wakeup = None
+
+    async def _enforce(self, panel_data: PanelType, batch: list[str]) -> None:
+        """Disable the users of a batch that are still over their limit."""
+        users_to_disable = []
+        for email in batch:
+            del self.pending[email]
+            ips = ACTIVE_USERS.active_ips(email)
+            if email not in DISABLED_USERS and self.over_limit(email, len(ips)):
+                await warn_user(email, ips)
+                users_to_disable.append(email)
+        if users_to_disable:
+            results = await disable_and_report(
+                panel_data, self.config_data, users_to_disable
+            )
+            for email, disabled in results.items():
+                if not disabled and email not in self.pending:
+                    self._schedule(email, ENFORCE_RETRY_DELAY)
+
+
+ENFORCER = Enforcer()
+ACTIVE_USERS.listener = ENFORCER.notify
+
+
+def apply_config(snapshot: ConfigSnapshot) -> None:
+    """
+    Take LIMITS, the length of the ACTIVE_USERS window and the ENFORCER settings
+    from a new config snapshot.
+    The window is 'IP_WINDOW' seconds, or 'CHECK_INTERVAL' if that is not set.
+
+    Args:
+        snapshot (ConfigSnapshot): The new config snapshot.
+    """
+    global LIMITS
+    LIMITS = snapshot.limits
+    window = snapshot.data.get("IP_WINDOW", snapshot.data.get("CHECK_INTERVAL"))
+    if window:
+        ACTIVE_USERS.configure(float(window))
+    ENFORCER.configure(dict(snapshot.data))
+
+
+subscribe_config(apply_config)
+
+
+async def check_users_usage(panel_data: PanelType) -> dict[str, bool]:
     """
     checks the usage of active users
+    (if 'INSTANT_ENFORCEMENT' is on they are passed to ENFORCER, which disables them)
+
+    Returns:
+        dict[str, bool]: The users that passed their limit and whether they were disabled.
     """
-    config_data = await read_config()
+    snapshot = await refresh_config()
     all_users_log = await check_ip_used()
-    except_users = config_data.get("EXCEPT_USERS", [])
-    special_limit = config_data.get("SPECIAL_LIMIT", {})
-    limit_number = config_data["GENERAL_LIMIT"]
+    if ENFORCER.enabled:
+        # catches users over a lowered limit without a new IP
+        for user_name, user_ip in all_users_log.items():
+            ENFORCER.notify(user_name, len(user_ip))
+        return {}
+    users_to_disable = []
     for user_name, user_ip in all_users_log.items():
-        if user_name not in except_users:
-            user_limit_number = int(special_limit.get(user_name, limit_number))
-            if len(set(user_ip)) > user_limit_number:
-                message = (
-                    f"User {user_name} has {str(len(set(user_ip)))}"
-                    + f" active ips. {str(set(user_ip))}"
-                )
-                logger.warning(message)
-                await send_logs(str("<b>Warning: </b>" + message))
-                try:
-                    await disable_user(panel_data, UserType(name=user_name, ip=[]))
-                except ValueError as error:
-                    print(error)
-    ACTIVE_USERS.clear()
+        if user_name in DISABLED_USERS:
+            continue
+        user_limit_number = LIMITS.limit(user_name)
+        if user_limit_number is not None and len(user_ip) > user_limit_number:
+            await warn_user(user_name, user_ip)
+            users_to_disable.append(user_name)
     all_users_log.clear()
+    if not users_to_disable:
+        return {}
+    return await disable_and_report(panel_data, snapshot.data, users_to_disable)
 
 
 async def run_check_users_usage(panel_data: PanelType) -> None:
@@ -0,0 +1,90 @@
+"""
+This module saves the GeoIP cache to the state file and loads it at startup,
+so after a restart the known IPs don't need to be looked up again.
+"""
+
+import asyncio
+import sqlite3
+
+from utils.logs import logger
+from utils.state_store import STATE_FILE, connect
+from utils.ttl_cache import TTLCache
+
+GEOIP_CACHE_FILE = STATE_FILE
+SAVE_INTERVAL = 300
+
+
+def save_cache(entries: list[tuple], filename: str = GEOIP_CACHE_FILE) -> int:
+    """
+    Replace the saved cache with the given entries.
+
+    Args:
+        entries (list[tuple]): The entries returned by TTLCache.dump().
+        filename (str): The SQLite file.
+
+    Returns:
+        int: The number of saved entries.
+    """
+    connection = connect(filename)
+    try:
+        with connection:
+            connection.execute("DELETE FROM geoip")
+            connection.executemany(
+                "INSERT INTO geoip (ip, country, expires_at) VALUES (?, ?, ?)",
+                entries,
+            )
+    finally:
+        connection.close()
+    return len(entries)
+
+
+def read_cache(filename: str = GEOIP_CACHE_FILE) -> list[tuple]:
+    """
+    Read the saved entries, to be passed to TTLCache.load().
+
+    Args:
+        filename (str): The SQLite file.
+
+    Returns:
+        list[tuple]: (ip, country, unix expiry) tuples, oldest first.
+    """
+    connection = connect(filename)
+    try:
+        entries = connection.execute(
+            "SELECT ip, country, expires_at FROM geoip ORDER BY rowid"
+        ).fetchall()
+    finally:
+        connection.close()
+    return entries
+
+
+async def load_geoip_cache(cache: TTLCache) -> None:
+    """
+    Load the GeoIP cache from disk without blocking the event loop.
+    The file is read in a thread, the cache is only changed on the event loop.
+    """
+    try:
+        loaded = cache.load(await asyncio.to_thread(read_cache))
+        logger.info("Loaded %s cached IP locations", loaded)
+    except sqlite3.Error as error:
+        logger.error("Failed to load %s: %s", GEOIP_CACHE_FILE, error)
+
+
+async def save_geoip_cache(cache: TTLCache) -> None:
+    """
+    Save the GeoIP cache to disk without blocking the event loop.
+    The entries are copied on the event loop (the lookups reorder the cache)
+    and only the copy is written in a thread.
+    """
+    try:
+        saved = await asyncio.to_thread(save_cache, cache.dump())
+        logger.info("Saved %s cached IP locations", saved)
+    except sqlite3.Error as error:
+        logger.error("Failed to save %s: %s", GEOIP_CACHE_FILE, error)
+
+
+async def run_save_geoip_cache(cache: TTLCache) -> None:
+    """Save the GeoIP cache every 'SAVE_INTERVAL' seconds."""
+    while True:
+        await asyncio.sleep(SAVE_INTERVAL)
+        await save_geoip_cache(cache)
@@ -0,0 +1,265 @@
+"""
+This module contains an offline IP to country resolver.
+It loads a local database (CSV of IP ranges or CIDRs, or MMDB) into sorted arrays
+and finds the country of an IP address with a binary search, without any network request.
+"""
+
+# pylint: disable=global-statement
+
+import asyncio
+import csv
+import ipaddress
+import socket
+from bisect import bisect_right
+
+from utils.logs import logger
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+GEOIP_DATABASE: "GeoIPDatabase | MMDBDatabase | None" = None
+HTTP_FALLBACK = True
+
+
+def ip_to_int(ip: str) -> tuple[int, int]:
+    """
+    Convert an IP address string to its version and integer value.
+
+    Args:
+        ip (str): The IP address.
+
+    Returns:
+        tuple[int, int]: (4 or 6, the address as an integer).
+
+    Raises:
+        OSError: If the string is not a valid IP address.
+    """
+    if ":" in ip:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+    return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+
+
+# ::ffff:0:0/96, the IPv4-mapped IPv6 addresses (IPv4 in the IPv6 CSV files)
+MAPPED_FIRST = 0xFFFF << 32
+MAPPED_LAST = MAPPED_FIRST + 2**32 - 1
+
+
+def _parse_address(value: str) -> tuple[int | None, int]:
+    """
+    Parse a range boundary written as an IP address or as an integer.
+    The version of an integer is not known (None).
+    """
+    value = value.strip()
+    if value.isascii() and value.isdigit():
+        return None, int(value)
+    return ip_to_int(value)
+
+
+def _parse_range(first_value: str, last_value: str) -> list[tuple[int, int, int]]:
+    """
+    Parse the boundaries of a range into (version, first, last) tuples.
+
+    The version is chosen once for the row: IPv6 if a boundary is an IPv6 address
+    or the last integer doesn't fit in 32 bits. The part of an IPv6 range that is
+    in ::ffff:0:0/96 (how the IPv6 LITE files store IPv4) goes to the IPv4 table.
+    """
+    first_version, first = _parse_address(first_value)
+    last_version, last = _parse_address(last_value)
+    if first > last:
+        raise ValueError(f"Invalid range {first_value} - {last_value}")
+    if 6 not in (first_version, last_version) and last < 2**32:
+        return [(4, first, last)]
+    ranges = []
+    if first <= MAPPED_LAST and last >= MAPPED_FIRST:
+        ranges.append(
+            (
+                4,
+                max(first, MAPPED_FIRST) - MAPPED_FIRST,
+                min(last, MAPPED_LAST) - MAPPED_FIRST,
+            )
+        )
+        if first < MAPPED_FIRST:
+            ranges.append((6, first, MAPPED_FIRST - 1))
+        if last > MAPPED_LAST:
+            ranges.append((6, MAPPED_LAST + 1, last))
+        return ranges
+    return [(6, first, last)]
+
+
+class GeoIPDatabase:
+    """
+    IP ranges sorted by their first address, one table for IPv4 and one for IPv6.
+
+    The CSV rows can be 'cidr,country' (like '1.0.0.0/24,AU') or
+    'first_ip,last_ip,country,...' where the addresses are IP strings or integers
+    (the format of the DB-IP and IP2Location LITE country files).
+    """
+
+    def __init__(self):
+        self._starts: dict[int, list[int]] = {4: [], 6: []}
+        self._ends: dict[int, list[int]] = {4: [], 6: []}
+        self._countries: dict[int, list[str]] = {4: [], 6: []}
+
+    @classmethod
+    def from_ranges(cls, ranges: list[tuple[int, int, int, str]]) -> "GeoIPDatabase":
+        """
+        Build the database from (version, first, last, country) tuples.
+
+        Args:
+            ranges (list[tuple[int, int, int, str]]): The IP ranges, in any order.
+
+        Returns:
+            GeoIPDatabase: The database.
+        """
+        database = cls()
+        for version, first, last, country in sorted(ranges):
+            database._starts[version].append(first)
+            database._ends[version].append(last)
+            database._countries[version].append(country)
+        return database
+
+    @classmethod
+    def from_csv(cls, filename: str) -> "GeoIPDatabase":
+        """
+        Load the database from a CSV file, invalid rows (and headers) are skipped.
+
+        Args:
+            filename (str): The CSV file.
+
+        Returns:
+            GeoIPDatabase: The database.
+        """
+        ranges = []
+        countries = {}
+        with open(filename, "r", encoding="utf-8", newline="") as file:
+            for row in csv.reader(file):
+                try:
+                    if len(row) == 2:
+                        network = ipaddress.ip_network(row[0].strip(), strict=False)
+                        row_ranges = [
+                            (
+                                network.version,
+                                int(network.network_address),
+                                int(network.broadcast_address),
+                            )
+                        ]
+                        country = row[1]
+                    else:
+                        row_ranges = _parse_range(row[0], row[1])
+                        country = row[2]
+                except (IndexError, ValueError, OSError):
+                    continue
+                country = country.strip().upper()
+                if country in ("", "-", "ZZ"):
+                    continue
+                # share one string object for each country code
+                country = countries.setdefault(country, country)
+                ranges.extend(
+                    (version, first, last, country)
+                    for version, first, last in row_ranges
+                )
+        return cls.from_ranges(ranges)
+
+    def lookup(self, ip: str) -> str | None:
+        """
+        Find the country code of an IP address.
+
+        Args:
+            ip (str): The IP address.
+
+        Returns:
+            str | None: The country code, or None if it is not in the database.
+        """
+        try:
+            version, number = ip_to_int(ip)
+        except OSError:
+            return None
+        if version == 6 and MAPPED_FIRST <= number <= MAPPED_LAST:
+            version, number = 4, number - MAPPED_FIRST
+        index = bisect_right(self._starts[version], number) - 1
+        if index >= 0 and number <= self._ends[version][index]:
+            return self._countries[version][index]
+        return None
+
+    def __len__(self) -> int:
+        return len(self._starts[4]) + len(self._starts[6])
+
+
+class MMDBDatabase:
+    """A MaxMind (or compatible) .mmdb country database, needs the 'maxminddb' module."""
+
+    def __init__(self, filename: str):
+        self._reader = maxminddb.open_database(filename)
+
+    def lookup(self, ip: str) -> str | None:
+        """
+        Find the country code of an IP address.
+
+        Args:
+            ip (str): The IP address.
+
+        Returns:
+            str | None: The country code, or None if it is not in the database.
+        """
+        try:
+            record = self._reader.get(ip)
+        except ValueError:
+            return None
+        if not isinstance(record, dict):
+            return None
+        country = record.get("country") or record.get("registered_country") or {}
+        return country.get("iso_code") or record.get("country_code")
+
+    def __len__(self) -> int:
+        return self._reader.metadata().node_count
+
+
+def open_database(filename: str) -> GeoIPDatabase | MMDBDatabase:
+    """
+    Open a GeoIP database file, the format is chosen by the file extension.
+
+    Args:
+        filename (str): A .mmdb or a .csv file.
+
+    Returns:
+        GeoIPDatabase | MMDBDatabase: The database.
+
+    Raises:
+        ValueError: If the file is .mmdb and the 'maxminddb' module is not installed.
+    """
+    if filename.endswith(".mmdb"):
+        if maxminddb is None:
+            raise ValueError(
+                "Module 'maxminddb' is not installed use:"
+                + " 'pip install maxminddb' to read .mmdb files"
+            )
+        return MMDBDatabase(filename)
+    return GeoIPDatabase.from_csv(filename)
+
+
+async def load_geoip_database(config: dict) -> None:
+    """
+    Load the offline database set in 'GEOIP_DATABASE' in the config file.
+    'GEOIP_HTTP_FALLBACK' (default true) decides if the HTTP APIs are used
+    for the IPs that are not in the database.
+
+    Args:
+        config (dict): The config data.
+    """
+    global GEOIP_DATABASE
+    global HTTP_FALLBACK
+    HTTP_FALLBACK = bool(config.get("GEOIP_HTTP_FALLBACK", True))
+    filename = config.get("GEOIP_DATABASE")
+    if not filename:
+        GEOIP_DATABASE = None
+        return
+    try:
+        GEOIP_DATABASE = await asyncio.to_thread(open_database, filename)
+        logger.info(
+            "Loaded GeoIP database %s (%s entries)", filename, len(GEOIP_DATABASE)
+        )
+    except (OSError, RuntimeError, ValueError) as error:
+        logger.error("Failed to load GeoIP database %s: %s", filename, error)
+        GEOIP_DATABASE = None
@@ -6,13 +6,15 @@ import asyncio
 import random
 import ssl
 import sys
+import time
 from asyncio import Task
 from ssl import SSLError
 
-from utils.parse_logs import INVALID_IPS
+from utils.parse_logs import add_node_ip
 
 try:
     import websockets.client
+    import websockets.exceptions
 except ImportError:
     print(
         "Module 'websockets' is not installed use: 'pip install websockets' to install it"
@@ -20,134 +22,311 @@ except ImportError:
     sys.exit()
 from telegram_bot.send_message import send_logs
 from utils.logs import logger  # pylint: disable=ungrouped-imports
-from utils.panel_api import get_nodes, get_token
-from utils.parse_logs import parse_logs
-from utils.types import NodeType, PanelType
+from utils.node_inventory import NODE_INVENTORY
+from utils.panel_api import PANEL_SCHEME, TOKEN_MANAGER
+from utils.parse_logs import queue_logs
+from utils.read_config import read_config
+from utils.types import NodeEventKind, NodeType, PanelType, StreamState
 
 TASKS = []
-
-task_node_mapping = {}
+# name -> the supervisor of each running log stream
+STREAMS: dict[str, "StreamSupervisor"] = {}
+STREAM_BASE_DELAY = 1.0
+STREAM_MAX_DELAY = 300.0
+# failures in a row before a stream is reported as dead
+STREAM_DEAD_AFTER = 8
+# a stream closed cleanly after this many seconds is reconnected right away
+STREAM_MIN_UPTIME = 10
+FAST_RECONNECT_DELAY = 0.5
+STREAM_CHECK_INTERVAL = 30
+DEFAULT_STREAM_STALL_TIMEOUT = 180
+
+# node_id -> the log stream task of the node
+NODE_TASKS: dict[int, Task] = {}
 ssl_context = ssl.create_default_context()
 ssl_context.check_hostname = False
 ssl_context.verify_mode = ssl.CERT_NONE
 
 
-async def get_panel_logs(panel_data: PanelType) -> None:
+def is_auth_error(error: Exception) -> bool:
     """
-    This function establishes a websocket connection to the main server and retrieves logs.
+    Check if a websocket error means the panel rejected the access token.
 
     Args:
-        panel_data (PanelType): The credentials for the panel.
+        error (Exception): The error raised by the websocket connection.
 
-    Raises:
-        ValueError: If there is an issue with getting the panel token.
+    Returns:
+        bool: True if the token should be refreshed before the next connection.
     """
-    for scheme in ["wss", "ws"]:
-        while True:
-            interval = random.choice(("0.9", "1.3", "1.5", "1.7"))
-            get_panel_token = await get_token(panel_data)
-            if isinstance(get_panel_token, ValueError):
-                raise get_panel_token
-            token = get_panel_token.panel_token
+    if isinstance(error, websockets.exceptions.InvalidStatusCode):
+        return error.status_code in (401, 403)
+    if isinstance(error, websockets.exceptions.ConnectionClosed):
+        return error.rcvd is not None and error.rcvd.code in (4401, 4403)
+    return False
+
+
+class StreamSupervisor:  # pylint: disable=too-many-instance-attributes
+    """
+    Keeps one log websocket (of the main panel or of a node) connected.
+
+    Failures are retried after a jittered exponential backoff (up to
+    'STREAM_MAX_DELAY' seconds), a clean close is reconnected right away.
+    Telegram is only notified when the stream goes up, down or dead,
+    not for every failed try.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        panel_data: PanelType,
+        name: str,
+        path: str,
+        label: str,
+        *,
+        sink=None,
+        notify=None,
+    ):
+        """
+        Args:
+            panel_data (PanelType): The credentials for the panel.
+            name (str): A short name for the logs, like '[Main panel]'.
+            path (str): The path of the websocket, like '/api/core/logs'.
+            label (str): Describes the stream in the notifications.
+            sink (Callable[[str], Awaitable] | None): Called with each received log,
+                queue_logs() if None.
+            notify (Callable[[str], Awaitable] | None): Sends the notifications,
+                send_logs() if None.
+        """
+        self.panel_data = panel_data
+        self.name = name
+        self.path = path
+        self.label = label
+        self.sink = sink or queue_logs
+        self.notify = notify or send_logs
+        self.state = StreamState.CONNECTING
+        self.failures = 0
+        self.last_error: Exception | None = None
+        # the token of the last connection (invalidated if the panel rejects it)
+        self.token: str | None = None
+        self._ws: websockets.client.WebSocketClientProtocol | None = None
+        # liveness of the current connection
+        self.connected_at = 0.0
+        self.last_frame_at = 0.0
+        self.bytes_received = 0
+        self.bytes_per_second = 0.0
+        self.recycles = 0
+        self._recycled = False
+        self._rate_bytes = 0
+        self._rate_at = 0.0
+        # the last state that was sent to Telegram ('up', 'down' or 'dead')
+        self._reported: str | None = None
+
+    def backoff_delay(self) -> float:
+        """Return the delay before the next try, half fixed and half random."""
+        cap = min(STREAM_MAX_DELAY, STREAM_BASE_DELAY * 2 ** max(0, self.failures - 1))
+        return random.uniform(cap / 2, cap)
+
+    async def _report(self, reported: str, message: str) -> None:
+        """Send a notification if the reported state changed, else only log it."""
+        if reported == self._reported:
+            logger.info(message)
+            return
+        self._reported = reported
+        await self.notify(message)
+        if reported == "up":
+            logger.info(message)
+        else:
+            logger.error(message)
+
+    async def _connect(self) -> websockets.client.WebSocketClientProtocol:
+        """
+        Open the websocket on the first scheme that works.
+
+        Returns:
+            WebSocketClientProtocol: The websocket.
+        """
+        interval = random.choice(("0.9", "1.3", "1.5", "1.7"))
+        token = self.token = await TOKEN_MANAGER.get_token(self.panel_data)
+        ssl_error = None
+        for scheme in PANEL_SCHEME.websocket_schemes():
+            url = (
+                f"{scheme}://{self.panel_data.panel_domain}{self.path}"
+                + f"?interval={interval}&token={token}"
+            )
             try:
-                async with websockets.client.connect(
-                    f"{scheme}://{panel_data.panel_domain}/api/core"
-                    + f"/logs?interval={interval}&token={token}",
-                    ssl=ssl_context if scheme == "wss" else None,
-                ) as ws:
-                    log_message = "Establishing connection for the main panel"
-                    await send_logs(log_message)
-                    logger.info(log_message)
-                    while True:
-                        new_log = await ws.recv()
-                        await parse_logs(str(new_log))
-
-            except SSLError:
-                break
-            except Exception as error:  # pylint: disable=broad-except
-                log_message = (
-                    f"[Main panel] Failed to connect {error} trying 20 second later!"
+                ws = await websockets.client.connect(
+                    url, ssl=ssl_context if scheme == "wss" else None
                 )
-                await send_logs(log_message)
-                logger.error(log_message)
-                await asyncio.sleep(20)
+            except SSLError as error:
+                PANEL_SCHEME.report_failure(scheme)
+                ssl_error = error
                 continue
+            except OSError:
+                PANEL_SCHEME.report_failure(scheme)
+                raise
+            PANEL_SCHEME.report_success(scheme)
+            return ws
+        raise ssl_error
+
+    async def _stream(self, ws: websockets.client.WebSocketClientProtocol) -> None:
+        """Receive logs until the websocket is closed."""
+        self._ws = ws
+        self.connected_at = self.last_frame_at = self._rate_at = time.monotonic()
+        self._rate_bytes = self.bytes_received
+        try:
+            while True:
+                new_log = str(await ws.recv())
+                self.last_frame_at = time.monotonic()
+                self.bytes_received += len(new_log)
+                await self.sink(new_log)
+        finally:
+            self._ws = None
+            await ws.close()
+
+    def stats(self) -> dict:
+        """
+        Return the liveness of the stream and update its receive rate.
+
+        Returns:
+            dict: The state, seconds since the last frame, bytes/sec
+            and the websocket ping round trip time in seconds.
+        """
+        now = time.monotonic()
+        if now > self._rate_at:
+            self.bytes_per_second = (self.bytes_received - self._rate_bytes) / (
+                now - self._rate_at
+            )
+        self._rate_bytes = self.bytes_received
+        self._rate_at = now
+        streaming = self._ws is not None
+        return {
+            "state": self.state.value,
+            "idle": now - self.last_frame_at if streaming else None,
+            "bytes_per_second": self.bytes_per_second if streaming else 0.0,
+            "latency": self._ws.latency if streaming else None,
+        }
+
+    def is_stalled(self, timeout: float) -> bool:
+        """Return True if the stream is connected but got no frame for 'timeout' seconds."""
+        return (
+            self._ws is not None
+            and self.state == StreamState.STREAMING
+            and time.monotonic() - self.last_frame_at > timeout
+        )
+
+    async def recycle(self) -> None:
+        """Close the current connection, run() reconnects right away."""
+        if self._ws is not None:
+            self.recycles += 1
+            self._recycled = True
+            await self._ws.close()
+
+    async def run(self) -> None:
+        """Connect and reconnect the stream forever."""
+        STREAMS[self.name] = self
+        try:
+            while True:
+                self.state = StreamState.CONNECTING
+                connected_at = None
+                try:
+                    ws = await self._connect()
+                    connected_at = time.monotonic()
+                    self.state = StreamState.STREAMING
+                    await self._report(
+                        "up", f"Establishing connection for {self.label}"
+                    )
+                    await self._stream(ws)
+                except Exception as error:  # pylint: disable=broad-except
+                    recycled, self._recycled = self._recycled, False
+                    clean = isinstance(error, websockets.exceptions.ConnectionClosedOK)
+                    # closed by recycle() (even if the close handshake timed out),
+                    # or cleanly after a while: not a failure
+                    if recycled or (
+                        clean and time.monotonic() - connected_at >= STREAM_MIN_UPTIME
+                    ):
+                        self.failures = 0
+                        logger.info("%s The stream was closed, reconnecting", self.name)
+                        await asyncio.sleep(FAST_RECONNECT_DELAY)
+                        continue
+                    # includes a clean close right after connecting,
+                    # so it isn't reconnected in a loop
+                    await self._fail(error, connected_at)
+        finally:
+            if STREAMS.get(self.name) is self:
+                del STREAMS[self.name]
+
+    async def _fail(self, error: Exception, connected_at: float | None) -> None:
+        """Count a failure, notify on state changes and wait before the next try."""
+        if is_auth_error(error):
+            TOKEN_MANAGER.invalidate(self.token)
+        if (
+            connected_at is not None
+            and time.monotonic() - connected_at >= STREAM_MIN_UPTIME
+        ):
+            # it was streaming for a while, start the backoff over
+            self.failures = 0
+        self.failures += 1
+        self.last_error = error
+        delay = self.backoff_delay()
+        if self.failures >= STREAM_DEAD_AFTER:
+            self.state = StreamState.DEAD
+            await self._report(
+                "dead",
+                f"{self.name} {self.label} is down after {self.failures} tries"
+                + f" [Error Message: {error}] retrying every {int(STREAM_MAX_DELAY)}"
+                + " seconds at most",
+            )
+        else:
+            self.state = StreamState.BACKOFF
+            await self._report(
+                "down",
+                f"{self.name} Failed to connect {self.label} [Error Message: {error}]"
+                + f" trying {delay:.0f} seconds later!",
+            )
+        await asyncio.sleep(delay)
 
 
-async def get_nodes_logs(panel_data: PanelType, node: NodeType) -> None:
+async def get_panel_logs(panel_data: PanelType) -> None:
     """
-    This function establishes a websocket connection to a specific node and retrieves logs.
+    This function establishes a websocket connection to the main server and retrieves logs.
 
     Args:
         panel_data (PanelType): The credentials for the panel.
-        node (NodeType): The specific node to connect to.
+    """
+    await StreamSupervisor(
+        panel_data, "[Main panel]", "/api/core/logs", "the main panel"
+    ).run()
+
 
-    Raises:
-        ValueError: If there is an issue with getting the panel token.
+def node_stream(panel_data: PanelType, node: NodeType, **kwargs) -> StreamSupervisor:
     """
-    for scheme in ["wss", "ws"]:
-        while True:
-            interval = random.choice(("0.9", "1.3", "1.5", "1.7"))
-            get_panel_token = await get_token(panel_data)
-            if isinstance(get_panel_token, ValueError):
-                raise get_panel_token
-            token = get_panel_token.panel_token
-            try:
-                url = f"{scheme}://{panel_data.panel_domain}/api/node/{node.node_id}/logs?interval={interval}&token={token}"  # pylint: disable=line-too-long
-                async with websockets.client.connect(
-                    url,
-                    ssl=ssl_context if scheme == "wss" else None,
-                ) as ws:
-                    log_message = (
-                        "Establishing connection for"
-                        + f" node number {node.node_id} name: {node.node_name}"
-                    )
-                    await send_logs(log_message)
-                    logger.info(log_message)
-                    while True:
-                        new_log = await ws.recv()
-                        await parse_logs(str(new_log))
-            except SSLError:
-                break
-            except Exception as error:  # pylint: disable=broad-except
-                log_message = (
-                    f"Failed to connect to this node [node id: {node.node_id}]"
-                    + f" [node name: {node.node_name}]"
-                    + f" [node ip: {node.node_ip}] [node message: {node.message}]"
-                    + f" [Error Message: {error}] trying to connect 10 second later!"
-                )
-                await send_logs(log_message)
-                logger.error(log_message)
-                await asyncio.sleep(10)
-                continue
+    Create the supervisor of the log websocket of a node.
+
+    Args:
+        panel_data (PanelType): The credentials for the panel.
+        node (NodeType): The node.
+        **kwargs: Passed to StreamSupervisor (sink, notify).
+
+    Returns:
+        StreamSupervisor: The supervisor, not running yet.
+    """
+    return StreamSupervisor(
+        panel_data,
+        f"[Node {node.node_id}]",
+        f"/api/node/{node.node_id}/logs",
+        f"node number {node.node_id} name: {node.node_name} ip: {node.node_ip}",
+        **kwargs,
+    )
 
 
-async def handle_cancel(panel_data: PanelType, tasks: list[Task]) -> None:
+async def get_nodes_logs(panel_data: PanelType, node: NodeType) -> None:
     """
-    An asynchronous coroutine that cancels all tasks in the given list.
+    This function establishes a websocket connection to a specific node and retrieves logs.
 
     Args:
         panel_data (PanelType): The credentials for the panel.
-        tasks (list[Task]): The list of tasks to be cancelled.
+        node (NodeType): The specific node to connect to.
     """
-    deactivate_nodes = set()
-    while True:
-        nodes_list = await get_nodes(panel_data)
-        for node in nodes_list:
-            if node.status != "connected":
-                deactivate_nodes.add(f"Task-{node.node_id}-{node.node_name}")
-
-        for task in tasks:
-            if task.get_name() in deactivate_nodes:
-                log_message = f"Cancelling {task.get_name()}"
-                await send_logs(log_message)
-                logger.info(log_message)
-                deactivate_nodes.remove(task.get_name())
-                task.cancel()
-                tasks.remove(task)
-                if task in task_node_mapping:
-                    task_node_mapping.pop(task)
-        await asyncio.sleep(20)
+    await node_stream(panel_data, node).run()
 
 
 async def handle_cancel_one(tasks: list[Task]) -> None:
@@ -165,58 +344,79 @@ async def handle_cancel_one(tasks: list[Task]) -> None:
             tasks.remove(task)
 
 
-async def handle_cancel_all(tasks: list[Task], panel_data: PanelType) -> None:
+async def monitor_streams() -> None:
     """
-    An asynchronous coroutine that cancels All tasks in the given list.
+    Check the log streams every 'STREAM_CHECK_INTERVAL' seconds and reconnect only
+    the ones that are connected but got no logs for 'STREAM_STALL_TIMEOUT' seconds
+    (set in the config file, default 180).
     To fix these issues: #67, #65, #62 And many more
+    """
+    while True:
+        await asyncio.sleep(STREAM_CHECK_INTERVAL)
+        data = await read_config()
+        timeout = float(data.get("STREAM_STALL_TIMEOUT", DEFAULT_STREAM_STALL_TIMEOUT))
+        for stream in list(STREAMS.values()):
+            stats = stream.stats()
+            logger.debug("%s %s", stream.name, stats)
+            if stream.is_stalled(timeout):
+                logger.warning(
+                    "%s No logs for %.0f seconds (ping %s), reconnecting",
+                    stream.name,
+                    stats["idle"],
+                    stats["latency"],
+                )
+                await stream.recycle()
 
-    Args:
-        tasks (list[Task]): The list of tasks to be cancelled.
+
+async def handle_node_events(
+    panel_data: PanelType, tg: asyncio.TaskGroup, pool=None
+) -> None:
     """
-    # pylint: disable=duplicate-code
-    async with asyncio.TaskGroup() as tg:
-        while True:
-            await asyncio.sleep(8192)  # =~ 2 hours and 27 minutes
-            for task in tasks:
-                print(f"Cancelling {task.get_name()}...")
-                task.cancel()
-                tasks.remove(task)
-            print("Start Create Panel Task Test: ")
-            await create_panel_task(panel_data, tg)
-            await asyncio.sleep(5)
-            nodes_list = await get_nodes(panel_data)
-            if nodes_list and not isinstance(nodes_list, ValueError):
-                print("Start Create Nodes Task Test: ")
-                for node in nodes_list:
-                    if node.status == "connected":
-                        await create_node_task(panel_data, tg, node)
-                        await asyncio.sleep(3)
-
-
-async def check_and_add_new_nodes(panel_data: PanelType, tg: asyncio.TaskGroup) -> None:
-    """
-    An asynchronous coroutine that checks for new nodes and creates tasks for them.
+    Start and cancel the log streams of the nodes on the events of the node inventory:
+    a stream runs for each connected node and is cancelled when the node
+    is disconnected or removed.
 
     Args:
         panel_data (PanelType): The credentials for the panel.
-        tg (asyncio.TaskGroup): The TaskGroup to which the new task will be added.
+        tg (asyncio.TaskGroup): The TaskGroup to which the node tasks are added.
+        pool (IngestPool | None): Run the streams in these worker processes
+            instead of this process.
     """
-    while True:
-        all_nodes = await get_nodes(panel_data)
-        if all_nodes and not isinstance(all_nodes, ValueError):
-            for node in all_nodes:
-                if (
-                    node not in task_node_mapping.values()
-                    and node.status == "connected"
-                ):
+    events = NODE_INVENTORY.subscribe()
+    try:
+        while True:
+            event = await events.get()
+            node = event.node
+            running = node.node_id in (NODE_TASKS if pool is None else pool.nodes)
+            if event.kind is NodeEventKind.CHANGED:
+                if node.node_ip != event.previous.node_ip:
+                    add_node_ip(node.node_ip)
+                continue
+            connected = event.kind is not NodeEventKind.REMOVED and (
+                node.status == "connected"
+            )
+            if connected and not running:
+                if not event.initial:
                     log_message = (
                         f"Add a new node. id: {node.node_id}"
                         + f" name: {node.node_name} ip: {node.node_ip}"
                     )
                     await send_logs(log_message)
                     logger.info(log_message)
+                if pool is None:
                     await create_node_task(panel_data, tg, node)
-        await asyncio.sleep(25)
+                else:
+                    pool.start_node(node)
+            elif not connected and running:
+                log_message = f"Cancelling Task-{node.node_id}-{node.node_name}"
+                await send_logs(log_message)
+                logger.info(log_message)
+                if pool is None:
+                    NODE_TASKS[node.node_id].cancel()
+                else:
+                    pool.stop_node(node.node_id)
+    finally:
+        NODE_INVENTORY.unsubscribe(events)
 
 
 async def create_panel_task(panel_data: PanelType, tg: asyncio.TaskGroup) -> None:
@@ -243,9 +443,24 @@ async def create_node_task(
         tg (asyncio.TaskGroup): The TaskGroup to which the new task will be added.
         node (NodeType): The node for which the new task will be created.
     """
-    INVALID_IPS.add(node.node_ip)
+    add_node_ip(node.node_ip)
     task = tg.create_task(
         get_nodes_logs(panel_data, node), name=f"Task-{node.node_id}-{node.node_name}"
     )
     TASKS.append(task)
-    task_node_mapping[task] = node
+    NODE_TASKS[node.node_id] = task
+    task.add_done_callback(forget_node_task)
+
+
+def forget_node_task(task: Task) -> None:
+    """
+    Remove a finished node task from TASKS and NODE_TASKS.
+
+    Args:
+        task (Task): The task that is done (or cancelled).
+    """
+    if task in TASKS:
+        TASKS.remove(task)
+    for node_id, node_task in list(NODE_TASKS.items()):
+        if node_task is task:
+            del NODE_TASKS[node_id]
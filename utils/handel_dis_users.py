@@ -1,36 +1,104 @@
 """
 This module contains the DisabledUsers class
 which provides methods for managing disabled users
+and the time each of them should be enabled again.
 """
 
+# pylint: disable=global-statement
+
+import asyncio
+import heapq
 import json
 import os
+import time
 
 from utils.logs import logger
+from utils.loop_lock import LoopLock
+from utils.read_config import refresh_config
+from utils.state_store import STATE_STORE
 
 DISABLED_USERS = set()
+DIS_USERS: "DisabledUsers | None" = None
+DEFAULT_PENALTY_MULTIPLIER = 1
+DEFAULT_MAX_PENALTY = 86400
+DEFAULT_PENALTY_RESET = 86400
+# rewrite the JSON file when the journal has this many lines
+JOURNAL_COMPACT_SIZE = 1000
+
+
+def penalty_time(data, offences: int) -> float:
+    """
+    Return how long a user stays disabled for its n-th offence.
+
+    The first offence is 'TIME_TO_ACTIVE_USERS' seconds, each repeat is
+    multiplied by 'PENALTY_MULTIPLIER' (default 1, no escalation)
+    up to 'MAX_PENALTY' seconds.
 
+    Args:
+        data (Mapping): The config data.
+        offences (int): The number of recent offences, including this one.
 
-class DisabledUsers:
+    Returns:
+        float: The penalty in seconds.
+    """
+    base = float(data["TIME_TO_ACTIVE_USERS"])
+    multiplier = float(data.get("PENALTY_MULTIPLIER", DEFAULT_PENALTY_MULTIPLIER))
+    max_penalty = max(base, float(data.get("MAX_PENALTY", DEFAULT_MAX_PENALTY)))
+    return min(base * multiplier ** max(0, offences - 1), max_penalty)
+
+
+class DisabledUsers:  # pylint: disable=too-many-instance-attributes
     """
     A class used to represent the Disabled Users.
+
+    The users are kept in a min-heap of (enable time, username), so the next user
+    to enable is found without scanning all of them.
+    Entries of users that were enabled or rescheduled stay in the heap
+    and are skipped when they reach the top.
+
+    Changes are appended to a journal file next to the JSON file
+    (one line per change, one fsync for all the changes waiting to be written),
+    the JSON file is only rewritten when the journal is compacted.
     """
 
     def __init__(self, filename=".disable_users.json"):
         self.filename = filename
+        self.journal_filename = os.path.splitext(filename)[0] + ".journal"
+        # username -> unix time when it should be enabled
+        self.enable_at: dict[str, float] = {}
+        # username -> [number of recent offences, unix time of the last one]
+        self.offences: dict[str, list] = {}
+        self.journal_size = 0
         self.disabled_users = self.load_disabled_users()
+        self._heap = [(due, name) for name, due in self.enable_at.items()]
+        heapq.heapify(self._heap)
+        DISABLED_USERS.update(self.disabled_users)
+        self.wakeup: asyncio.Event | None = None
+        self.penalty_reset = DEFAULT_PENALTY_RESET
+        self._pending: list[dict] = []
+        self._lock = LoopLock()
 
     def load_disabled_users(self):
         """
-        Loads the disabled users from the JSON file.
+        Loads the disabled users, their enable times and offences from the JSON file
+        and replays the journal on top of it.
+        Users saved without an enable time (older files) are enabled right away.
         """
         try:
+            users = set()
             if os.path.exists(self.filename):
                 with open(self.filename, "r", encoding="utf-8") as file:
                     data = json.load(file)
-                    return set(data.get("disable_user", []))
-            else:
-                return set()
+                users = set(data.get("disable_user", []))
+                enable_at = data.get("enable_at", {})
+                self.enable_at = {name: float(enable_at.get(name, 0)) for name in users}
+                self.offences = {
+                    name: [int(count), float(last)]
+                    for name, (count, last) in data.get("offences", {}).items()
+                }
+            if os.path.exists(self.journal_filename):
+                self._replay_journal(users)
+            return users
         except Exception as error:  # pylint: disable=broad-except
             logger.error(error)
             print("Check the error or delete the file :", error)
@@ -39,23 +107,156 @@ class DisabledUsers:
                 print("Deleting ...")
                 logger.info("remove .disable_users.json file")
                 os.remove(".disable_users.json")
+                if os.path.exists(self.journal_filename):
+                    os.remove(self.journal_filename)
             return set()
 
+    def _replay_journal(self, users: set[str]) -> None:
+        """Apply the changes of the journal file (a torn last line is ignored)."""
+        with open(self.journal_filename, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipped a broken line of %s", self.journal_filename)
+                    continue
+                self.journal_size += 1
+                if "add" in record:
+                    users.add(record["add"])
+                    self.enable_at[record["add"]] = float(record["enable_at"])
+                    if "offences" in record:
+                        self.offences[record["add"]] = record["offences"]
+                elif "enable" in record:
+                    for name in record["enable"]:
+                        users.discard(name)
+                        self.enable_at.pop(name, None)
+
+    def _write_snapshot(self, data: dict) -> None:
+        """Replace the JSON file atomically and empty the journal."""
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, self.filename)
+        with open(self.journal_filename, "w", encoding="utf-8"):
+            pass
+
+    def _write_journal(self, records: list[dict]) -> None:
+        """Append records to the journal file with one fsync."""
+        with open(self.journal_filename, "a", encoding="utf-8") as file:
+            file.write("".join(json.dumps(record) + "\n" for record in records))
+            file.flush()
+            os.fsync(file.fileno())
+
+    async def _append(self, record: dict) -> None:
+        """
+        Add a record to the journal. The records added while a write is
+        in progress are written together by the next one.
+        """
+        self._pending.append(record)
+        async with self._lock.get():
+            if not self._pending:
+                return
+            records, self._pending = self._pending, []
+            await asyncio.to_thread(self._write_journal, records)
+            self.journal_size += len(records)
+        if self.journal_size >= JOURNAL_COMPACT_SIZE:
+            await self.save_disabled_users()
+
     async def save_disabled_users(self):
         """
-        Saves the disabled users to the JSON file.
+        Saves the disabled users, their enable times and offences to the JSON file
+        (compacts the journal).
         """
-        with open(self.filename, "w", encoding="utf-8") as file:
-            json.dump({"disable_user": list(self.disabled_users)}, file)
+        async with self._lock.get():
+            data = {
+                "disable_user": list(self.disabled_users),
+                "enable_at": dict(self.enable_at),
+                "offences": dict(self.offences),
+            }
+            # the pending records are already in the data
+            self._pending.clear()
+            await asyncio.to_thread(self._write_snapshot, data)
+            self.journal_size = 0
+
+    def _schedule(self, username: str, enable_at: float) -> None:
+        """Set the enable time of a user and wake up the scheduler."""
+        DISABLED_USERS.add(username)
+        self.disabled_users.add(username)
+        self.enable_at[username] = enable_at
+        heapq.heappush(self._heap, (enable_at, username))
+        if self.wakeup is not None:
+            self.wakeup.set()
 
     async def add_user(self, username: str):
         """
         Adds a user to the set of disabled users
-        and saves the updated set to the JSON file.
+        and appends it to the journal.
+        The user is enabled after its penalty time, which grows for
+        repeat offences within 'PENALTY_RESET' seconds of the previous one.
+        A user that is already disabled is kept as it is (no new offence).
         """
-        DISABLED_USERS.add(username)
-        self.disabled_users.add(username)
-        await self.save_disabled_users()
+        if username in self.disabled_users:
+            return
+        snapshot = await refresh_config()
+        now = time.time()
+        self.penalty_reset = float(
+            snapshot.data.get("PENALTY_RESET", DEFAULT_PENALTY_RESET)
+        )
+        count, last = self.offences.get(username, (0, 0.0))
+        count = count + 1 if now - last < self.penalty_reset else 1
+        self.offences[username] = [count, now]
+        enable_at = now + penalty_time(snapshot.data, count)
+        self._schedule(username, enable_at)
+        STATE_STORE.record_disable(username, now, enable_at, count)
+        await self._append(
+            {"add": username, "enable_at": enable_at, "offences": [count, now]}
+        )
+
+    async def reschedule(self, username: str, enable_at: float):
+        """
+        Set a new enable time for a disabled user (without counting an offence),
+        for example to retry a user that failed to be enabled.
+        """
+        self._schedule(username, enable_at)
+        await self._append({"add": username, "enable_at": enable_at})
+
+    def next_due(self) -> float | None:
+        """
+        Returns the unix time when the next user should be enabled,
+        or None if there are no disabled users.
+        """
+        while self._heap:
+            due, username = self._heap[0]
+            if self.enable_at.get(username) == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    async def pop_due_users(self, now: float | None = None) -> set[str]:
+        """
+        Returns the users whose enable time is over and removes them
+        from the disabled users.
+        """
+        now = time.time() if now is None else now
+        due_users = set()
+        while (due := self.next_due()) is not None and due <= now:
+            _, username = heapq.heappop(self._heap)
+            del self.enable_at[username]
+            self.disabled_users.discard(username)
+            DISABLED_USERS.discard(username)
+            due_users.add(username)
+        if due_users:
+            # forget the offences that can't make a penalty longer anymore
+            self.offences = {
+                name: offence
+                for name, offence in self.offences.items()
+                if now - offence[1] < self.penalty_reset or name in self.enable_at
+            }
+            STATE_STORE.record_enable(due_users, now)
+            await self._append({"enable": sorted(due_users)})
+        return due_users
 
     async def read_and_clear_users(self):
         """
@@ -64,6 +265,18 @@ class DisabledUsers:
         """
         disabled_users = list(self.disabled_users)
         self.disabled_users.clear()
+        self.enable_at.clear()
+        self._heap.clear()
         DISABLED_USERS.clear()
         await self.save_disabled_users()
         return set(disabled_users)
+
+
+def get_disabled_users() -> DisabledUsers:
+    """
+    Return the shared DisabledUsers instance, it is loaded from the file once.
+    """
+    global DIS_USERS
+    if DIS_USERS is None:
+        DIS_USERS = DisabledUsers()
+    return DIS_USERS
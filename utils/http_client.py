@@ -0,0 +1,110 @@
+"""
+This module keeps the shared HTTP clients used for the panel API and GeoIP lookups.
+One long-lived client per upstream lets connections (and TLS sessions) be reused.
+"""
+
+# pylint: disable=global-statement
+
+import sys
+
+from utils.logs import logger
+from utils.read_config import read_config
+
+try:
+    import httpx
+except ImportError:
+    print("Module 'httpx' is not installed use: 'pip install httpx' to install it")
+    sys.exit()
+
+try:
+    import h2  # pylint: disable=unused-import
+
+    HTTP2_SUPPORT = True
+except ImportError:
+    HTTP2_SUPPORT = False
+
+PANEL_CLIENT: httpx.AsyncClient | None = None
+GEOIP_CLIENT: httpx.AsyncClient | None = None
+
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 60
+
+
+def create_client(config: dict | None = None, http2: bool = False) -> httpx.AsyncClient:
+    """
+    Create a new pooled AsyncClient.
+
+    The pool limits are read from the config file:
+    'HTTP_MAX_CONNECTIONS', 'HTTP_MAX_KEEPALIVE_CONNECTIONS' and 'HTTP_KEEPALIVE_EXPIRY'.
+
+    Args:
+        config (dict | None): The config data, the defaults are used if it is None.
+        http2 (bool): Enable HTTP/2 (only if the 'h2' package is installed).
+
+    Returns:
+        httpx.AsyncClient: The new client.
+    """
+    config = config or {}
+    limits = httpx.Limits(
+        max_connections=int(
+            config.get("HTTP_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)
+        ),
+        max_keepalive_connections=int(
+            config.get(
+                "HTTP_MAX_KEEPALIVE_CONNECTIONS", DEFAULT_MAX_KEEPALIVE_CONNECTIONS
+            )
+        ),
+        keepalive_expiry=float(
+            config.get("HTTP_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY)
+        ),
+    )
+    return httpx.AsyncClient(verify=False, limits=limits, http2=http2 and HTTP2_SUPPORT)
+
+
+async def start_clients() -> None:
+    """
+    Create the shared panel and GeoIP clients.
+    Should be called once at startup (and close_clients() on shutdown).
+    """
+    global PANEL_CLIENT
+    global GEOIP_CLIENT
+    await close_clients()
+    config = await read_config()
+    PANEL_CLIENT = create_client(config, http2=True)
+    GEOIP_CLIENT = create_client(config)
+    if not HTTP2_SUPPORT:
+        logger.info("Module 'h2' is not installed, HTTP/2 is disabled")
+
+
+async def close_clients() -> None:
+    """Close the shared clients and their connections."""
+    global PANEL_CLIENT
+    global GEOIP_CLIENT
+    for client in (PANEL_CLIENT, GEOIP_CLIENT):
+        if client is not None:
+            await client.aclose()
+    PANEL_CLIENT = None
+    GEOIP_CLIENT = None
+
+
+def get_panel_client() -> httpx.AsyncClient:
+    """
+    Return the shared client for the panel API.
+    If start_clients() wasn't called, it is created with the default limits.
+    """
+    global PANEL_CLIENT
+    if PANEL_CLIENT is None:
+        PANEL_CLIENT = create_client(http2=True)
+    return PANEL_CLIENT
+
+
+def get_geoip_client() -> httpx.AsyncClient:
+    """
+    Return the shared client for the GeoIP APIs.
+    If start_clients() wasn't called, it is created with the default limits.
+    """
+    global GEOIP_CLIENT
+    if GEOIP_CLIENT is None:
+        GEOIP_CLIENT = create_client()
+    return GEOIP_CLIENT
@@ -0,0 +1,238 @@
+"""
+This module runs the log streams of the nodes in worker processes,
+for panels with more nodes than one process can keep up with
+('INGEST_WORKERS' in the config, read at startup,
+0 runs everything in the main process).
+
+Each node is streamed by the worker hash(node_id) % workers. A worker receives
+and parses the logs and sends the connections counted per user and IP address
+to the main process every 'DELTA_INTERVAL' seconds. The main process validates
+the IPs, keeps ACTIVE_USERS and enforces the limits as before.
+"""
+
+import asyncio
+import multiprocessing
+import time
+from asyncio import Task
+from collections import Counter
+from multiprocessing.connection import Connection
+
+from telegram_bot.send_message import forward_logs, send_logs
+from utils.get_logs import monitor_streams, node_stream
+from utils.http_client import close_clients, start_clients
+from utils.logs import logger
+from utils.panel_api import PANEL_SCHEME
+from utils.parse_logs import add_node_ip, count_connections, record_connections
+from utils.types import NodeType, PanelType
+
+DEFAULT_INGEST_WORKERS = 0
+DELTA_INTERVAL = 0.5
+
+
+async def read_messages(conn: Connection):
+    """
+    Yield the messages received on a pipe without blocking the event loop.
+
+    Args:
+        conn (Connection): The end of the pipe to read.
+
+    Yields:
+        tuple: The messages.
+
+    Raises:
+        EOFError: If the other end of the pipe is closed.
+    """
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    loop.add_reader(conn.fileno(), ready.set)
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            while conn.poll():
+                yield conn.recv()
+    finally:
+        loop.remove_reader(conn.fileno())
+
+
+class IngestWorker:
+    """
+    Runs the node streams of one worker process and counts their connections.
+
+    Messages sent to the main process:
+        ("deltas", time, {(email, ip): connections})
+        ("log", message) for the notifications of the streams
+    Messages received from the main process:
+        ("start", NodeType) and ("stop", node_id)
+    """
+
+    def __init__(self, panel_data: PanelType, conn: Connection):
+        self.panel_data = panel_data
+        self.conn = conn
+        self.counts = Counter()
+        self.streams: dict[int, Task] = {}
+
+    async def collect(self, log: str) -> None:
+        """Count the connections of a received log."""
+        self.counts.update(count_connections(log))
+
+    async def notify(self, message: str) -> None:
+        """Pass a notification to the main process."""
+        self.conn.send(("log", message))
+
+    async def send_deltas(self) -> None:
+        """Send the counted connections every 'DELTA_INTERVAL' seconds."""
+        while True:
+            await asyncio.sleep(DELTA_INTERVAL)
+            if self.counts:
+                counts, self.counts = self.counts, Counter()
+                self.conn.send(("deltas", time.time(), dict(counts)))
+
+    async def run(self) -> None:
+        """
+        Start and stop the node streams on the commands of the main process,
+        until it closes the pipe.
+        All the messages of send_logs() in this process go through the pipe.
+        """
+        forward_logs(self.notify)
+        await start_clients()
+        try:
+            async with asyncio.TaskGroup() as tg:
+                background = [
+                    tg.create_task(self.send_deltas()),
+                    tg.create_task(monitor_streams()),
+                ]
+                try:
+                    async for action, value in read_messages(self.conn):
+                        if action == "start" and value.node_id not in self.streams:
+                            self.streams[value.node_id] = tg.create_task(
+                                node_stream(
+                                    self.panel_data,
+                                    value,
+                                    sink=self.collect,
+                                    notify=self.notify,
+                                ).run()
+                            )
+                        elif action == "stop" and value in self.streams:
+                            self.streams.pop(value).cancel()
+                except EOFError:
+                    logger.info("The main process closed the pipe, stopping")
+                finally:
+                    for task in background + list(self.streams.values()):
+                        task.cancel()
+        finally:
+            await close_clients()
+
+
+def worker_main(index: int, panel_data: PanelType, scheme: str | None, conn) -> None:
+    """
+    The entry point of a worker process.
+
+    Args:
+        index (int): The number of the worker.
+        panel_data (PanelType): The credentials for the panel.
+        scheme (str | None): The scheme of the panel found by the main process.
+        conn (Connection): The worker end of the pipe.
+    """
+    PANEL_SCHEME.scheme = scheme
+    logger.info("Ingest worker %s started", index)
+    try:
+        asyncio.run(IngestWorker(panel_data, conn).run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+class IngestPool:
+    """
+    Starts the worker processes and sends each node to its worker.
+
+    Attributes:
+        workers (int): The number of worker processes.
+        nodes (set[int]): The IDs of the nodes streamed by the workers.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.nodes: set[int] = set()
+        self._connections: list[Connection] = []
+        self._processes: list[multiprocessing.Process] = []
+
+    def shard(self, node_id: int) -> int:
+        """Return the worker that streams a node."""
+        return hash(node_id) % self.workers
+
+    def start_node(self, node: NodeType) -> None:
+        """
+        Start the log stream of a node in its worker.
+
+        Args:
+            node (NodeType): The node.
+        """
+        add_node_ip(node.node_ip)
+        self.nodes.add(node.node_id)
+        self._connections[self.shard(node.node_id)].send(("start", node))
+
+    def stop_node(self, node_id: int) -> None:
+        """
+        Stop the log stream of a node.
+
+        Args:
+            node_id (int): The ID of the node.
+        """
+        self.nodes.discard(node_id)
+        self._connections[self.shard(node_id)].send(("stop", node_id))
+
+    async def _receive(self, index: int, conn: Connection) -> None:
+        """Apply the messages of a worker."""
+        try:
+            async for message in read_messages(conn):
+                if message[0] == "deltas":
+                    await record_connections(message[2], message[1])
+                elif message[0] == "log":
+                    await send_logs(message[1])
+        except EOFError as error:
+            message = f"Ingest worker {index} exited"
+            logger.error(message)
+            raise RuntimeError(message) from error
+
+    async def run(self, panel_data: PanelType) -> None:
+        """
+        Start the workers and apply their messages until one of them exits.
+        The workers are started before the first await, so start_node()
+        works once this task has started (create it before the node inventory task).
+
+        Args:
+            panel_data (PanelType): The credentials for the panel.
+
+        Raises:
+            RuntimeError: If a worker exits.
+        """
+        context = multiprocessing.get_context("spawn")
+        try:
+            for index in range(self.workers):
+                conn, child_conn = context.Pipe()
+                process = context.Process(
+                    target=worker_main,
+                    args=(index, panel_data, PANEL_SCHEME.scheme, child_conn),
+                    name=f"ingest-{index}",
+                    daemon=True,
+                )
+                process.start()
+                child_conn.close()
+                self._connections.append(conn)
+                self._processes.append(process)
+            async with asyncio.TaskGroup() as tg:
+                for index, conn in enumerate(self._connections):
+                    tg.create_task(self._receive(index, conn))
+        finally:
+            for conn in self._connections:
+                conn.close()
+            for process in self._processes:
+                process.join(1)
+                if process.is_alive():
+                    process.terminate()
+            self._connections.clear()
+            self._processes.clear()
+            self.nodes.clear()
@@ -0,0 +1,115 @@
+"""
+This module contains a small inotify wrapper (Linux only, through ctypes)
+used to know when a file is written without polling it.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    An inotify file descriptor that watches directories for written files.
+
+    Raises:
+        OSError: If inotify is not available.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path: str, mask: int = IN_CLOSE_WRITE | IN_MOVED_TO) -> int:
+        """
+        Watch a directory.
+
+        Args:
+            path (str): The directory.
+            mask (int): The events to watch (IN_* flags).
+
+        Returns:
+            int: The watch descriptor.
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read_names(self) -> list[str]:
+        """Return the file names of the events that are ready (without blocking)."""
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            names.append(os.fsdecode(data[offset : offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+    async def wait(self, name: str) -> None:
+        """
+        Wait until a file with this name is written in a watched directory.
+
+        Args:
+            name (str): The file name (without the directory).
+        """
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        loop.add_reader(self.fd, ready.set)
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                if name in self.read_names():
+                    return
+        finally:
+            loop.remove_reader(self.fd)
+
+    def close(self) -> None:
+        """Close the inotify file descriptor."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def open_inotify(directory: str) -> Inotify | None:
+    """
+    Watch a directory with inotify.
+
+    Args:
+        directory (str): The directory.
+
+    Returns:
+        Inotify | None: The watcher, None if inotify is not available.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        watcher = Inotify()
+    except (OSError, AttributeError):
+        return None
+    try:
+        watcher.add_watch(directory)
+    except OSError:
+        watcher.close()
+        return None
+    return watcher
@@ -0,0 +1,229 @@
+"""
+This module contains the IpTracker class,
+a sliding-window counter of the IP addresses each user connects from.
+"""
+
+import sys
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from utils.types import IpActivity
+
+
+@dataclass(slots=True)
+class UserWindow:
+    """
+    The sliding window of one user.
+
+    Attributes:
+        ips (dict[str, IpActivity]): Connections of each IP inside the window.
+        active (set[str]): IPs with at least 'min_hits' connections inside the window.
+        buckets (list[dict[str, int] | None]): Ring buffer of sub-buckets (IP -> hits).
+        epochs (list[int]): The epoch each sub-bucket belongs to.
+        last_epoch (int): The newest epoch this user was seen in.
+    """
+
+    ips: dict[str, IpActivity] = field(default_factory=dict)
+    active: set[str] = field(default_factory=set)
+    buckets: list[dict[str, int] | None] = field(default_factory=list)
+    epochs: list[int] = field(default_factory=list)
+    last_epoch: int = -1
+
+
+class IpTracker:  # pylint: disable=too-many-instance-attributes
+    """
+    Counts the connections of each user per IP address over the last 'window' seconds.
+
+    The window is split into 'bucket_count' sub-buckets kept in a ring buffer per user.
+    Old sub-buckets are subtracted as time moves on, so the set of IPs seen at least
+    'min_hits' times is always up to date and never has to be rebuilt or cleared.
+    Users with nothing left in their window are dropped from a timing wheel of epochs.
+
+    Attributes:
+        listener (Callable[[str, int], None] | None): Called with the username and
+        its number of active IPs whenever a user gets a new active IP.
+    """
+
+    def __init__(self, window: float = 60, bucket_count: int = 12, min_hits: int = 3):
+        """
+        Args:
+            window (float): The length of the window in seconds.
+            bucket_count (int): The number of sub-buckets in the window.
+            min_hits (int): Connections needed for an IP to count as active.
+        """
+        self.window = float(window)
+        self.bucket_count = bucket_count
+        self.min_hits = min_hits
+        self._users: dict[str, UserWindow] = {}
+        self._active_users: set[str] = set()
+        # epoch -> users that were seen in it (to drop idle users)
+        self._seen: dict[int, set[str]] = {}
+        self._epoch = -1
+        self.listener: Callable[[str, int], None] | None = None
+
+    @property
+    def bucket_width(self) -> float:
+        """The length of one sub-bucket in seconds."""
+        return self.window / self.bucket_count
+
+    def _epoch_of(self, now: float) -> int:
+        return int(now // self.bucket_width)
+
+    def _expire_user(self, email: str, user: UserWindow, epoch: int) -> None:
+        """Subtract the sub-buckets of a user that are older than the window."""
+        oldest = epoch - self.bucket_count
+        for slot, slot_epoch in enumerate(user.epochs):
+            bucket = user.buckets[slot]
+            if bucket is None or slot_epoch > oldest:
+                continue
+            for ip, hits in bucket.items():
+                activity = user.ips[ip]
+                activity.count -= hits
+                if activity.count <= 0:
+                    del user.ips[ip]
+                    user.active.discard(ip)
+                elif activity.count < self.min_hits:
+                    user.active.discard(ip)
+            user.buckets[slot] = None
+        if not user.active:
+            self._active_users.discard(email)
+
+    def _advance(self, now: float) -> int:
+        """Move the clock and drop the users that were not seen inside the window."""
+        epoch = self._epoch_of(now)
+        if epoch <= self._epoch:
+            return max(epoch, self._epoch)
+        oldest = epoch - self.bucket_count
+        for old_epoch in [key for key in self._seen if key <= oldest]:
+            for email in self._seen.pop(old_epoch):
+                user = self._users.get(email)
+                if user is not None and user.last_epoch <= oldest:
+                    del self._users[email]
+                    self._active_users.discard(email)
+        self._epoch = epoch
+        return epoch
+
+    def add(
+        self, email: str, ip: str, count: int = 1, now: float | None = None
+    ) -> None:
+        """
+        Record connections of a user from an IP address.
+
+        Args:
+            email (str): The username.
+            ip (str): The IP address.
+            count (int): The number of connections.
+            now (float | None): The time of the connections, the current time if None.
+        """
+        if now is None:
+            now = time.time()
+        epoch = self._advance(now)
+        user = self._users.get(email)
+        if user is None:
+            email = sys.intern(email)
+            user = self._users[email] = UserWindow(
+                buckets=[None] * self.bucket_count,
+                epochs=[-1] * self.bucket_count,
+            )
+        if user.last_epoch != epoch:
+            self._expire_user(email, user, epoch)
+            user.last_epoch = epoch
+            self._seen.setdefault(epoch, set()).add(email)
+        slot = epoch % self.bucket_count
+        bucket = user.buckets[slot]
+        if bucket is None or user.epochs[slot] != epoch:
+            bucket = user.buckets[slot] = {}
+            user.epochs[slot] = epoch
+        activity = user.ips.get(ip)
+        if activity is None:
+            ip = sys.intern(ip)
+            activity = user.ips[ip] = IpActivity(0, now)
+        bucket[ip] = bucket.get(ip, 0) + count
+        activity.count += count
+        activity.last_seen = now
+        if activity.count >= self.min_hits and ip not in user.active:
+            user.active.add(ip)
+            self._active_users.add(email)
+            if self.listener is not None:
+                self.listener(email, len(user.active))
+
+    def active_ips(self, email: str, now: float | None = None) -> set[str]:
+        """
+        Return the distinct IPs of a user seen at least 'min_hits' times inside the window.
+
+        Args:
+            email (str): The username.
+            now (float | None): The current time, time.time() if None.
+
+        Returns:
+            set[str]: The active IPs (empty if the user is unknown).
+        """
+        epoch = self._advance(time.time() if now is None else now)
+        user = self._users.get(email)
+        if user is None:
+            return set()
+        if user.last_epoch != epoch:
+            self._expire_user(email, user, epoch)
+        return set(user.active)
+
+    def active_users(self, now: float | None = None) -> dict[str, set[str]]:
+        """
+        Return the users that have at least one active IP, with their active IPs.
+
+        Args:
+            now (float | None): The current time, time.time() if None.
+
+        Returns:
+            dict[str, set[str]]: Username -> active IPs.
+        """
+        now = time.time() if now is None else now
+        result = {}
+        for email in list(self._active_users):
+            ips = self.active_ips(email, now)
+            if ips:
+                result[email] = ips
+        return result
+
+    def get(self, email: str) -> UserWindow | None:
+        """Return the window of a user, or None if the user is not tracked."""
+        return self._users.get(email)
+
+    def reset(self, email: str) -> None:
+        """Forget all the connections of a user (for example after disabling it)."""
+        self._users.pop(email, None)
+        self._active_users.discard(email)
+
+    def clear(self) -> None:
+        """Forget all the users."""
+        self._users.clear()
+        self._active_users.clear()
+        self._seen.clear()
+
+    def configure(self, window: float, bucket_count: int | None = None) -> None:
+        """
+        Change the window length, the tracked data is dropped if it changes.
+
+        Args:
+            window (float): The length of the window in seconds.
+            bucket_count (int | None): The number of sub-buckets, unchanged if None.
+        """
+        bucket_count = bucket_count or self.bucket_count
+        if float(window) == self.window and bucket_count == self.bucket_count:
+            return
+        self.window = float(window)
+        self.bucket_count = bucket_count
+        self._epoch = -1
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, email: str) -> bool:
+        return email in self._users
+
+    def __repr__(self) -> str:
+        return (
+            f"IpTracker(window={self.window}, users={len(self._users)}, "
+            + f"active_users={len(self._active_users)})"
+        )
@@ -0,0 +1,22 @@
+"""
+This module contains the LoopLock class, an asyncio.Lock for objects
+that live longer than one event loop (main() is restarted with asyncio.run()).
+"""
+
+import asyncio
+
+
+class LoopLock:  # pylint: disable=too-few-public-methods
+    """Gives an asyncio.Lock for the running event loop, a new one if the loop changed."""
+
+    def __init__(self):
+        self._lock: asyncio.Lock | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def get(self) -> asyncio.Lock:
+        """Return the lock of the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
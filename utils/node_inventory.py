@@ -0,0 +1,133 @@
+"""
+This module contains the node inventory: one task polls the nodes of the panel,
+compares them with the previous poll and sends the changes to its subscribers,
+so the log streams don't each poll the panel on their own.
+"""
+
+import asyncio
+
+from utils.logs import logger
+from utils.panel_api import get_nodes
+from utils.types import NodeEvent, NodeEventKind, NodeType, PanelType
+
+NODE_POLL_INTERVAL = 20
+
+
+def diff_nodes(
+    previous: dict[int, NodeType], current: dict[int, NodeType]
+) -> list[NodeEvent]:
+    """
+    Compare two polls of the nodes.
+
+    Args:
+        previous (dict[int, NodeType]): The nodes of the previous poll by ID.
+        current (dict[int, NodeType]): The nodes of this poll by ID.
+
+    Returns:
+        list[NodeEvent]: The changes, ordered by node ID.
+    """
+    events = []
+    for node_id in sorted(previous.keys() | current.keys()):
+        old = previous.get(node_id)
+        node = current.get(node_id)
+        if old is None:
+            events.append(NodeEvent(NodeEventKind.ADDED, node))
+        elif node is None:
+            events.append(NodeEvent(NodeEventKind.REMOVED, old, old))
+        elif node.status != old.status:
+            events.append(NodeEvent(NodeEventKind.STATUS_CHANGED, node, old))
+        elif node != old:
+            events.append(NodeEvent(NodeEventKind.CHANGED, node, old))
+    return events
+
+
+class NodeInventory:
+    """
+    Polls the nodes of the panel every 'NODE_POLL_INTERVAL' seconds
+    and puts the changes in the queue of each subscriber.
+
+    Attributes:
+        interval (float): Seconds between two polls.
+        nodes (dict[int, NodeType]): The nodes of the last poll by ID.
+    """
+
+    def __init__(self, interval: float = NODE_POLL_INTERVAL):
+        self.interval = interval
+        self.nodes: dict[int, NodeType] = {}
+        self._subscribers: list[asyncio.Queue] = []
+        self._polled = False
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Get the events of the next polls.
+
+        Returns:
+            asyncio.Queue: The queue the NodeEvent objects are put in.
+        """
+        queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """
+        Stop putting events in a queue returned by subscribe().
+
+        Args:
+            queue (asyncio.Queue): The queue.
+        """
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    async def poll(self, panel_data: PanelType) -> list[NodeEvent]:
+        """
+        Get the nodes from the panel once and publish the changes.
+
+        Args:
+            panel_data (PanelType): The credentials for the panel.
+
+        Returns:
+            list[NodeEvent]: The changes since the previous poll.
+
+        Raises:
+            ValueError: If the nodes can't be read from the panel.
+        """
+        nodes = await get_nodes(panel_data)
+        current = {node.node_id: node for node in nodes}
+        events = diff_nodes(self.nodes, current)
+        if not self._polled:
+            events = [
+                NodeEvent(event.kind, event.node, event.previous, initial=True)
+                for event in events
+            ]
+            self._polled = True
+        self.nodes = current
+        for event in events:
+            logger.debug("Node %s %s", event.node.node_id, event.kind.value)
+            for queue in self._subscribers:
+                queue.put_nowait(event)
+        return events
+
+    async def run(self, panel_data: PanelType) -> None:
+        """
+        Poll the panel every 'interval' seconds.
+        The first poll starts from no nodes, so every node is sent as added.
+        If a later poll fails, the last known nodes are kept.
+
+        Args:
+            panel_data (PanelType): The credentials for the panel.
+
+        Raises:
+            ValueError: If the first poll fails.
+        """
+        self.nodes = {}
+        self._polled = False
+        await self.poll(panel_data)
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll(panel_data)
+            except ValueError as error:
+                logger.error("Keeping the last known nodes: %s", error)
+
+
+NODE_INVENTORY = NodeInventory()
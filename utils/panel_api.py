@@ -3,8 +3,11 @@ This module contains functions to interact with the panel API.
 """
 
 import asyncio
+import base64
+import json
 import random
 import sys
+import time
 from ssl import SSLError
 
 try:
@@ -14,11 +17,107 @@ except ImportError:
     sys.exit()
 from telegram_bot.send_message import send_logs
 
-from utils.handel_dis_users import DISABLED_USERS, DisabledUsers
+from utils.handel_dis_users import get_disabled_users
+from utils.http_client import get_panel_client
 from utils.logs import logger
+from utils.loop_lock import LoopLock
 from utils.read_config import read_config
 from utils.types import NodeType, PanelType, UserType
 
+WEBSOCKET_SCHEMES = {"https": "wss", "http": "ws"}
+DEFAULT_ENABLE_CONCURRENCY = 10
+ENABLE_RETRY_DELAY = 60
+# the delay doubles for each failed retry of a user, up to this many seconds
+ENABLE_MAX_RETRY_DELAY = 3600
+# a user that still fails after this many retries is left for the admin to enable
+ENABLE_MAX_RETRIES = 10
+
+
+class PanelScheme:
+    """
+    Remembers which URL scheme (https or http) the panel answers on.
+
+    The scheme is discovered once and shared by the REST calls and the websocket loops.
+    Both schemes are tried again only after repeated connection failures.
+    """
+
+    def __init__(self, max_failures: int = 3):
+        """
+        Args:
+            max_failures (int): Connection failures in a row before the scheme is forgotten.
+        """
+        self.max_failures = max_failures
+        self.scheme: str | None = None
+        self.failures = 0
+
+    def schemes(self) -> list[str]:
+        """Return the schemes to try for a REST call, in order."""
+        if self.scheme:
+            return [self.scheme]
+        return ["https", "http"]
+
+    def websocket_schemes(self) -> list[str]:
+        """Return the schemes to try for a websocket connection, in order."""
+        return [WEBSOCKET_SCHEMES[scheme] for scheme in self.schemes()]
+
+    def report_success(self, scheme: str) -> None:
+        """
+        Save a scheme that the panel answered on.
+
+        Args:
+            scheme (str): 'https', 'http', 'wss' or 'ws'.
+        """
+        scheme = {"wss": "https", "ws": "http"}.get(scheme, scheme)
+        if self.scheme != scheme:
+            logger.info("Panel scheme is set to %s", scheme)
+        self.scheme = scheme
+        self.failures = 0
+
+    def report_failure(self, scheme: str) -> None:
+        """
+        Count a connection failure, after 'max_failures' the scheme is discovered again.
+
+        Args:
+            scheme (str): 'https', 'http', 'wss' or 'ws'.
+        """
+        scheme = {"wss": "https", "ws": "http"}.get(scheme, scheme)
+        if self.scheme is None or self.scheme != scheme:
+            return
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            logger.warning(
+                "Panel scheme %s failed %s times, trying to discover it again",
+                scheme,
+                self.failures,
+            )
+            self.scheme = None
+            self.failures = 0
+
+    async def discover(self, panel_data: PanelType) -> str | None:
+        """
+        Find the scheme the panel answers on (any HTTP response is enough).
+
+        Args:
+            panel_data (PanelType): A PanelType object containing
+            the username, password, and domain for the panel API.
+
+        Returns:
+            str | None: The working scheme, or None if the panel is not reachable.
+        """
+        for scheme in ["https", "http"]:
+            url = f"{scheme}://{panel_data.panel_domain}/api/admin"
+            try:
+                await get_panel_client().get(url, timeout=5)
+            except (SSLError, httpx.TransportError):
+                continue
+            self.report_success(scheme)
+            return scheme
+        logger.error("Can't reach the panel on https or http")
+        return None
+
+
+PANEL_SCHEME = PanelScheme()
+
 
 async def get_token(panel_data: PanelType) -> PanelType | ValueError:
     """
@@ -39,12 +138,12 @@ async def get_token(panel_data: PanelType) -> PanelType | ValueError:
         "password": f"{panel_data.panel_password}",
     }
     for attempt in range(20):
-        for scheme in ["https", "http"]:
+        for scheme in PANEL_SCHEME.schemes():
             url = f"{scheme}://{panel_data.panel_domain}/api/admin/token"
             try:
-                async with httpx.AsyncClient(verify=False) as client:
-                    response = await client.post(url, data=payload, timeout=5)
-                    response.raise_for_status()
+                response = await get_panel_client().post(url, data=payload, timeout=5)
+                PANEL_SCHEME.report_success(scheme)
+                response.raise_for_status()
                 json_obj = response.json()
                 panel_data.panel_token = json_obj["access_token"]
                 return panel_data
@@ -54,8 +153,11 @@ async def get_token(panel_data: PanelType) -> PanelType | ValueError:
                 logger.error(message)
                 continue
             except SSLError:
+                PANEL_SCHEME.report_failure(scheme)
                 continue
             except Exception as error:  # pylint: disable=broad-except
+                if isinstance(error, httpx.TransportError):
+                    PANEL_SCHEME.report_failure(scheme)
                 message = f"An unexpected error occurred: {error}"
                 await send_logs(message)
                 logger.error(message)
@@ -70,6 +172,119 @@ async def get_token(panel_data: PanelType) -> PanelType | ValueError:
     raise ValueError(message)
 
 
+def token_expiry(token: str) -> float | None:
+    """
+    Read the expiry time from the payload of a JWT access token.
+
+    The signature is not verified, the value is only used to know
+    when the token should be refreshed.
+
+    Args:
+        token (str): The access token from the panel API.
+
+    Returns:
+        float | None: The 'exp' claim as a unix timestamp, or None if it can't be read.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    """
+    Keeps the panel access token in memory and refreshes it shortly before it expires.
+
+    Concurrent callers share a single refresh (single-flight),
+    so only one login request is sent to the panel at a time.
+    If the refresh fails, the callers that waited for it get the same error
+    instead of trying to login again one after another.
+    """
+
+    def __init__(self, refresh_margin: int = 60, default_lifetime: int = 600):
+        """
+        Args:
+            refresh_margin (int): Seconds before the expiry to refresh the token.
+            default_lifetime (int): Lifetime to assume if the token has no 'exp' claim.
+        """
+        self.refresh_margin = refresh_margin
+        self.default_lifetime = default_lifetime
+        self.token: str | None = None
+        self.expires_at = 0.0
+        self._owner: tuple[str, str, str] | None = None
+        self._lock = LoopLock()
+        # the time and the error of the last failed refresh
+        self._failure: tuple[float, ValueError] | None = None
+
+    def _is_valid(self, panel_data: PanelType) -> bool:
+        owner = (
+            panel_data.panel_domain,
+            panel_data.panel_username,
+            panel_data.panel_password,
+        )
+        return (
+            self.token is not None
+            and self._owner == owner
+            and time.time() < self.expires_at - self.refresh_margin
+        )
+
+    async def get_token(self, panel_data: PanelType) -> str:
+        """
+        Return a valid access token, login to the panel only if it is needed.
+
+        Args:
+            panel_data (PanelType): A PanelType object containing
+            the username, password, and domain for the panel API.
+
+        Returns:
+            str: The access token from the panel API.
+
+        Raises:
+            ValueError: If the function fails to get a token from the panel.
+        """
+        if self._is_valid(panel_data):
+            panel_data.panel_token = self.token
+            return self.token
+        waiting_since = time.monotonic()
+        async with self._lock.get():
+            if not self._is_valid(panel_data):
+                if self._failure is not None and self._failure[0] >= waiting_since:
+                    raise self._failure[1]
+                get_panel_token = await get_token(panel_data)
+                if isinstance(get_panel_token, ValueError):
+                    self._failure = (time.monotonic(), get_panel_token)
+                    raise get_panel_token
+                self._failure = None
+                self.token = get_panel_token.panel_token
+                self.expires_at = token_expiry(self.token) or (
+                    time.time() + self.default_lifetime
+                )
+                self._owner = (
+                    panel_data.panel_domain,
+                    panel_data.panel_username,
+                    panel_data.panel_password,
+                )
+            panel_data.panel_token = self.token
+            return self.token
+
+    def invalidate(self, token: str | None = None) -> None:
+        """
+        Drop the cached token (for example after a 401 response).
+
+        Args:
+            token (str | None): The token that was rejected. If the cached token
+            has already been refreshed by another caller it is kept.
+        """
+        if token is None or token == self.token:
+            self.token = None
+            self.expires_at = 0.0
+
+
+TOKEN_MANAGER = TokenManager()
+
+
 async def all_user(panel_data: PanelType) -> list[UserType] | ValueError:
     """
     Get the list of all users from the panel API.
@@ -86,31 +301,35 @@ async def all_user(panel_data: PanelType) -> list[UserType] | ValueError:
         and HTTPS endpoints.
     """
     for attempt in range(20):
-        get_panel_token = await get_token(panel_data)
-        if isinstance(get_panel_token, ValueError):
-            raise get_panel_token
-        token = get_panel_token.panel_token
+        token = await TOKEN_MANAGER.get_token(panel_data)
         headers = {
             "Authorization": f"Bearer {token}",
         }
-        for scheme in ["https", "http"]:
+        for scheme in PANEL_SCHEME.schemes():
             url = f"{scheme}://{panel_data.panel_domain}/api/users"
             try:
-                async with httpx.AsyncClient(verify=False) as client:
-                    response = await client.get(url, headers=headers, timeout=10)
-                    response.raise_for_status()
+                response = await get_panel_client().get(
+                    url, headers=headers, timeout=10
+                )
+                PANEL_SCHEME.report_success(scheme)
+                response.raise_for_status()
                 user_inform = response.json()
                 return [
                     UserType(name=user["username"]) for user in user_inform["users"]
                 ]
             except SSLError:
+                PANEL_SCHEME.report_failure(scheme)
                 continue
             except httpx.HTTPStatusError:
+                if response.status_code == 401:
+                    TOKEN_MANAGER.invalidate(token)
                 message = f"[{response.status_code}] {response.text}"
                 await send_logs(message)
                 logger.error(message)
                 continue
             except Exception as error:  # pylint: disable=broad-except
+                if isinstance(error, httpx.TransportError):
+                    PANEL_SCHEME.report_failure(scheme)
                 message = f"An unexpected error occurred: {error}"
                 await send_logs(message)
                 logger.error(message)
@@ -125,62 +344,150 @@ async def all_user(panel_data: PanelType) -> list[UserType] | ValueError:
     raise ValueError(message)
 
 
-async def enable_all_user(panel_data: PanelType) -> None | ValueError:
+async def enable_user(panel_data: PanelType, username: str) -> bool | None:
     """
-    Enable all users on the panel.
+    Try once to enable a user on the panel.
 
     Args:
         panel_data (PanelType): A PanelType object containing
         the username, password, and domain for the panel API.
+        username (str): The username of the user to enable.
 
     Returns:
-        None
+        bool | None: True if the user was enabled, None if the user
+        doesn't exist on the panel anymore (404), False if it failed.
 
     Raises:
-        ValueError: If the function fails to enable the users on both the HTTP
-        and HTTPS endpoints.
+        ValueError: If the function fails to get a token from the panel.
     """
-    get_panel_token = await get_token(panel_data)
-    if isinstance(get_panel_token, ValueError):
-        raise get_panel_token
-    token = get_panel_token.panel_token
+    token = await TOKEN_MANAGER.get_token(panel_data)
     headers = {
         "Authorization": f"Bearer {token}",
     }
+    status = {"status": "active"}
+    for scheme in PANEL_SCHEME.schemes():
+        url = f"{scheme}://{panel_data.panel_domain}/api/user/{username}"
+        try:
+            response = await get_panel_client().put(
+                url, json=status, headers=headers, timeout=5
+            )
+            PANEL_SCHEME.report_success(scheme)
+            response.raise_for_status()
+            logger.info("Enabled user: %s", username)
+            return True
+        except SSLError:
+            PANEL_SCHEME.report_failure(scheme)
+            continue
+        except httpx.HTTPStatusError:
+            if response.status_code == 404:
+                logger.warning("Enable user %s: not found on the panel", username)
+                return None
+            if response.status_code == 401:
+                TOKEN_MANAGER.invalidate(token)
+            logger.error(
+                "Enable user %s: [%s] %s", username, response.status_code, response.text
+            )
+            continue
+        except Exception as error:  # pylint: disable=broad-except
+            if isinstance(error, httpx.TransportError):
+                PANEL_SCHEME.report_failure(scheme)
+            logger.error(
+                "Enable user %s: An unexpected error occurred: %s", username, error
+            )
+            continue
+    return False
+
+
+async def enable_users(
+    panel_data: PanelType,
+    usernames: list[str] | set[str],
+    concurrency: int = DEFAULT_ENABLE_CONCURRENCY,
+    attempts: int = 5,
+) -> set[str]:
+    """
+    Enable users concurrently, a failing user doesn't stop the others.
+    Only the users that failed are retried, and one summary message is sent at the end.
+    Users that don't exist on the panel anymore are not retried (nor returned).
+
+    Args:
+        panel_data (PanelType): A PanelType object containing
+        the username, password, and domain for the panel API.
+        usernames (list[str] | set[str]): The users to enable.
+        concurrency (int): How many users are enabled at the same time.
+        attempts (int): How many times a failed user is tried.
+
+    Returns:
+        set[str]: The users that could not be enabled.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def enable_one(username: str) -> tuple[str, bool | None]:
+        async with semaphore:
+            try:
+                return username, await enable_user(panel_data, username)
+            except ValueError:
+                return username, False
+
+    pending = list(dict.fromkeys(usernames))
+    total = len(pending)
+    if not total:
+        return set()
+    gone = []
+    for attempt in range(attempts):
+        results = await asyncio.gather(*(enable_one(name) for name in pending))
+        gone += [name for name, enabled in results if enabled is None]
+        pending = [name for name, enabled in results if enabled is False]
+        if not pending or attempt == attempts - 1:
+            break
+        await asyncio.sleep(random.randint(2, 5) * (attempt + 1))
+    message = f"Enabled <b>{total - len(pending) - len(gone)}</b> of {total} users"
+    if gone:
+        message += "\nNot found on the panel:\n- " + "\n- ".join(
+            f"<code>{name}</code>" for name in gone[:50]
+        )
+    if pending:
+        message += f"\nFailed to enable after {attempts} attempts:\n- " + "\n- ".join(
+            f"<code>{name}</code>" for name in pending[:50]
+        )
+        if len(pending) > 50:
+            message += f"\n... and {len(pending) - 50} more"
+        logger.error(message)
+    else:
+        logger.info(message)
+    await send_logs(message)
+    return set(pending)
+
+
+async def enable_all_user(panel_data: PanelType) -> set[str] | ValueError:
+    """
+    Enable all users on the panel.
+
+    Args:
+        panel_data (PanelType): A PanelType object containing
+        the username, password, and domain for the panel API.
+
+    Returns:
+        set[str]: The users that could not be enabled.
+
+    Raises:
+        ValueError: If the function fails to get the list of users.
+    """
     users = await all_user(panel_data)
     if isinstance(users, ValueError):
         raise users
-    for username in users:
-        for scheme in ["https", "http"]:  # add this later: save what scheme is used
-            url = f"{scheme}://{panel_data.panel_domain}/api/user/{username.name}"
-            status = {"status": "active"}
-            try:
-                async with httpx.AsyncClient(verify=False) as client:
-                    response = await client.put(
-                        url, json=status, headers=headers, timeout=5
-                    )
-                    response.raise_for_status()
-                message = f"Enabled user: {username.name}"
-                await send_logs(message)
-                logger.info(message)
-                break
-            except SSLError:
-                continue
-            except httpx.HTTPStatusError:
-                message = f"[{response.status_code}] {response.text}"
-                await send_logs(message)
-                logger.error(message)
-                continue
-            except Exception as error:  # pylint: disable=broad-except
-                message = f"An unexpected error occurred: {error}"
-                await send_logs(message)
-                logger.error(message)
+    config_data = await read_config()
+    failed = await enable_users(
+        panel_data,
+        [user.name for user in users],
+        int(config_data.get("ENABLE_CONCURRENCY", DEFAULT_ENABLE_CONCURRENCY)),
+    )
     logger.info("Enabled all users")
+    return failed
 
 
 async def enable_selected_users(
     panel_data: PanelType, inactive_users: set[str]
-) -> None | ValueError:
+) -> set[str]:
     """
     Enable selected users on the panel.
 
@@ -190,60 +497,16 @@ async def enable_selected_users(
         inactive_users (set[str]): A list of user str that are currently inactive.
 
     Returns:
-        None
-
-    Raises:
-        ValueError: If the function fails to enable the users on both the HTTP
-        and HTTPS endpoints.
+        set[str]: The users that could not be enabled.
     """
-    for username in inactive_users:
-        success = False
-        for attempt in range(5):
-            get_panel_token = await get_token(panel_data)
-            if isinstance(get_panel_token, ValueError):
-                raise get_panel_token
-            token = get_panel_token.panel_token
-            headers = {
-                "Authorization": f"Bearer {token}",
-            }
-            status = {"status": "active"}
-            for scheme in ["https", "http"]:
-                url = f"{scheme}://{panel_data.panel_domain}/api/user/{username}"
-                try:
-                    async with httpx.AsyncClient(verify=False) as client:
-                        response = await client.put(
-                            url, json=status, headers=headers, timeout=5
-                        )
-                        response.raise_for_status()
-                    message = f"Enabled user: {username}"
-                    await send_logs(message)
-                    logger.info(message)
-                    success = True
-                    break
-                except SSLError:
-                    continue
-                except httpx.HTTPStatusError:
-                    message = f"[{response.status_code}] {response.text}"
-                    await send_logs(message)
-                    logger.error(message)
-                    continue
-                except Exception as error:  # pylint: disable=broad-except
-                    message = f"An unexpected error occurred: {error}"
-                    await send_logs(message)
-                    logger.error(message)
-                    continue
-            if success:
-                break
-            await asyncio.sleep(random.randint(2, 5) * attempt)
-        if not success:
-            message = (
-                f"Failed enable user: {username} after 20 attempts. Make sure the panel is running "
-                + "and the username and password are correct."
-            )
-            await send_logs(message)
-            logger.error(message)
-            raise ValueError(message)
+    config_data = await read_config()
+    failed = await enable_users(
+        panel_data,
+        set(inactive_users),
+        int(config_data.get("ENABLE_CONCURRENCY", DEFAULT_ENABLE_CONCURRENCY)),
+    )
     logger.info("Enabled selected users")
+    return failed
 
 
 async def disable_user(panel_data: PanelType, username: UserType) -> None | ValueError:
@@ -263,36 +526,37 @@ async def disable_user(panel_data: PanelType, username: UserType) -> None | Valu
         and HTTPS endpoints.
     """
     for attempt in range(20):
-        get_panel_token = await get_token(panel_data)
-        if isinstance(get_panel_token, ValueError):
-            raise get_panel_token
-        token = get_panel_token.panel_token
+        token = await TOKEN_MANAGER.get_token(panel_data)
         headers = {
             "Authorization": f"Bearer {token}",
         }
         status = {"status": "disabled"}
-        for scheme in ["https", "http"]:
+        for scheme in PANEL_SCHEME.schemes():
             url = f"{scheme}://{panel_data.panel_domain}/api/user/{username.name}"
             try:
-                async with httpx.AsyncClient(verify=False) as client:
-                    response = await client.put(
-                        url, json=status, headers=headers, timeout=5
-                    )
-                    response.raise_for_status()
+                response = await get_panel_client().put(
+                    url, json=status, headers=headers, timeout=5
+                )
+                PANEL_SCHEME.report_success(scheme)
+                response.raise_for_status()
                 message = f"Disabled user: {username.name}"
                 await send_logs(message)
                 logger.info(message)
-                dis_obj = DisabledUsers()
-                await dis_obj.add_user(username.name)
+                await get_disabled_users().add_user(username.name)
                 return None
             except SSLError:
+                PANEL_SCHEME.report_failure(scheme)
                 continue
             except httpx.HTTPStatusError:
+                if response.status_code == 401:
+                    TOKEN_MANAGER.invalidate(token)
                 message = f"[{response.status_code}] {response.text}"
                 await send_logs(message)
                 logger.error(message)
                 continue
             except Exception as error:  # pylint: disable=broad-except
+                if isinstance(error, httpx.TransportError):
+                    PANEL_SCHEME.report_failure(scheme)
                 message = f"An unexpected error occurred: {error}"
                 await send_logs(message)
                 logger.error(message)
@@ -323,20 +587,19 @@ async def get_nodes(panel_data: PanelType) -> list[NodeType] | ValueError:
         and HTTPS endpoints.
     """
     for attempt in range(20):
-        get_panel_token = await get_token(panel_data)
-        if isinstance(get_panel_token, ValueError):
-            raise get_panel_token
-        token = get_panel_token.panel_token
+        token = await TOKEN_MANAGER.get_token(panel_data)
         headers = {
             "Authorization": f"Bearer {token}",
         }
         all_nodes = []
-        for scheme in ["https", "http"]:
+        for scheme in PANEL_SCHEME.schemes():
             url = f"{scheme}://{panel_data.panel_domain}/api/nodes"
             try:
-                async with httpx.AsyncClient(verify=False) as client:
-                    response = await client.get(url, headers=headers, timeout=10)
-                    response.raise_for_status()
+                response = await get_panel_client().get(
+                    url, headers=headers, timeout=10
+                )
+                PANEL_SCHEME.report_success(scheme)
+                response.raise_for_status()
                 user_inform = response.json()
                 for node in user_inform:
                     all_nodes.append(
@@ -350,13 +613,18 @@ async def get_nodes(panel_data: PanelType) -> list[NodeType] | ValueError:
                     )
                 return all_nodes
             except SSLError:
+                PANEL_SCHEME.report_failure(scheme)
                 continue
             except httpx.HTTPStatusError:
+                if response.status_code == 401:
+                    TOKEN_MANAGER.invalidate(token)
                 message = f"[{response.status_code}] {response.text}"
                 await send_logs(message)
                 logger.error(message)
                 continue
             except Exception as error:  # pylint: disable=broad-except
+                if isinstance(error, httpx.TransportError):
+                    PANEL_SCHEME.report_failure(scheme)
                 message = f"An unexpected error occurred: {error}"
                 await send_logs(message)
                 logger.error(message)
@@ -373,12 +641,46 @@ async def get_nodes(panel_data: PanelType) -> list[NodeType] | ValueError:
 
 async def enable_dis_user(panel_data: PanelType):
     """
-    Enable disabled users every 'TIME_TO_ACTIVE_USERS' seconds.
+    Enable each disabled user when its own penalty time is over.
+    It sleeps until the next user is due (or a new user is disabled),
+    users that fail to be enabled are retried 'ENABLE_RETRY_DELAY' seconds later,
+    the delay doubles for each retry (up to 'ENABLE_MAX_RETRY_DELAY') and a user
+    is dropped from the schedule after 'ENABLE_MAX_RETRIES' retries.
+    Users deleted from the panel are dropped right away.
     """
-    dis_obj = DisabledUsers()
+    dis_obj = get_disabled_users()
+    # username -> failed retries
+    retries: dict[str, int] = {}
+    wakeup = dis_obj.wakeup = asyncio.Event()
     while True:
-        data = await read_config()
-        await asyncio.sleep(int(data["TIME_TO_ACTIVE_USERS"]))
-        if DISABLED_USERS:
-            await enable_selected_users(panel_data, DISABLED_USERS)
-            await dis_obj.read_and_clear_users()
+        wakeup.clear()
+        due = dis_obj.next_due()
+        if due is None:
+            await wakeup.wait()
+            continue
+        delay = due - time.time()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(wakeup.wait(), delay)
+                continue
+            except asyncio.TimeoutError:
+                pass
+        users = await dis_obj.pop_due_users()
+        if not users:
+            continue
+        failed = await enable_selected_users(panel_data, users)
+        for username in users - failed:
+            retries.pop(username, None)
+        for username in failed:
+            count = retries[username] = retries.get(username, 0) + 1
+            if count > ENABLE_MAX_RETRIES:
+                del retries[username]
+                message = (
+                    f"Gave up enabling <code>{username}</code> after"
+                    + f" {ENABLE_MAX_RETRIES} retries, enable it on the panel"
+                )
+                logger.error(message)
+                await send_logs(message)
+                continue
+            delay = min(ENABLE_MAX_RETRY_DELAY, ENABLE_RETRY_DELAY * 2 ** (count - 1))
+            await dis_obj.reschedule(username, time.time() + delay)
@@ -2,20 +2,25 @@
 This module contains functions to parse and validate logs.
 """
 
+# pylint: disable=global-statement
+
+import asyncio
 import ipaddress
 import random
 import re
-import sys
+import time
+from collections import Counter
+from functools import lru_cache
 
+from utils import geoip_database
 from utils.check_usage import ACTIVE_USERS
-from utils.read_config import read_config
-from utils.types import UserType
-
-try:
-    import httpx
-except ImportError:
-    print("Module 'httpx' is not installed use: 'pip install httpx' to install it")
-    sys.exit()
+from utils.http_client import get_geoip_client
+from utils.ip_tracker import IpTracker
+from utils.logs import logger
+from utils.read_config import refresh_config, subscribe_config
+from utils.state_store import STATE_STORE
+from utils.ttl_cache import TTLCache
+from utils.types import ConfigSnapshot, LogRecord
 
 INVALID_EMAILS = [
     "API]",
@@ -27,12 +32,30 @@ INVALID_EMAILS = [
     "INFO",
     "request",
 ]
-INVALID_IPS = {
-    "1.1.1.1",
-    "8.8.8.8",
-}
-VALID_IPS = []
-CACHE = {}
+DEFAULT_INVALID_IPS = frozenset(
+    {
+        "1.1.1.1",
+        "8.8.8.8",
+    }
+)
+# addresses of the nodes (added when a node task is created)
+NODE_IPS: set[str] = set()
+# rebuilt from DEFAULT_INVALID_IPS, NODE_IPS and the config when one of them changes
+INVALID_IPS: frozenset[str] = DEFAULT_INVALID_IPS
+# 'IP_LOCATION' from the config, None until the first config snapshot
+IP_LOCATION: str | None = None
+CONFIG_INVALID_IPS: frozenset[str] = frozenset()
+IP_VERDICT_TTL = 6 * 60 * 60
+COUNTRY_TTL = 24 * 60 * 60
+# IPs that are checked and belong to 'IP_LOCATION'
+VALID_IPS = TTLCache(maxsize=100_000, ttl=IP_VERDICT_TTL)
+# IPs that are checked and belong to another country
+FOREIGN_IPS = TTLCache(maxsize=100_000, ttl=IP_VERDICT_TTL)
+# country code of each checked IP
+CACHE = TTLCache(maxsize=100_000, ttl=COUNTRY_TTL)
+# logs received from the websockets, waiting to be parsed
+LOG_QUEUE: asyncio.Queue | None = None
+LOG_QUEUE_SIZE = 1000
 
 API_ENDPOINTS = {
     "http://ip-api.com/json/": "countryCode",
@@ -42,6 +65,23 @@ API_ENDPOINTS = {
 }
 
 
+def strip_user_id(username: str) -> str:
+    """
+    Remove the ID from the start of the username (like '12.user' -> 'user').
+    Same result as re.sub(r"^\\d+\\.", "", username) without running a regex.
+
+    Args:
+        username (str): The username string from which to remove the ID.
+
+    Returns:
+        str: The username with the ID removed.
+    """
+    user_id, sep, name = username.partition(".")
+    if sep and user_id.isdecimal():
+        return name
+    return username
+
+
 async def remove_id_from_username(username: str) -> str:
     """
     Remove the ID from the start of the username.
@@ -51,7 +91,27 @@ async def remove_id_from_username(username: str) -> str:
     Returns:
         str: The username with the ID removed.
     """
-    return re.sub(r"^\d+\.", "", username)
+    return strip_user_id(username)
+
+
+def local_country(ip_address: str) -> None | str:
+    """
+    Find the country of an IP address without any network request
+    (from the cache or the offline database).
+
+    Args:
+        ip_address (str): The IP address to check.
+
+    Returns:
+        str: The country code of the IP address location, or None
+    """
+    country = CACHE.get(ip_address)
+    if country:
+        return country
+    database = geoip_database.GEOIP_DATABASE
+    if database is not None:
+        return database.lookup(ip_address)
+    return None
 
 
 async def check_ip(ip_address: str) -> None | str:
@@ -59,7 +119,10 @@ async def check_ip(ip_address: str) -> None | str:
     Check the geographical location of an IP address.
 
     Get the location of the IP address.
-    The result is cached to avoid unnecessary requests for the same IP address.
+    The offline database ('GEOIP_DATABASE') is used first if it is loaded,
+    the HTTP APIs are only used for the IPs that are not in it.
+    The result is cached to avoid unnecessary requests for the same IP address,
+    cached countries expire after 'COUNTRY_TTL' so reassigned IP ranges are checked again.
 
     Args:
         ip_address (str): The IP address to check.
@@ -67,15 +130,17 @@ async def check_ip(ip_address: str) -> None | str:
     Returns:
         str: The country code of the IP address location, or None
     """
-    if ip_address in CACHE:
-        return CACHE[ip_address]
+    country = local_country(ip_address)
+    if country or (
+        geoip_database.GEOIP_DATABASE is not None and not geoip_database.HTTP_FALLBACK
+    ):
+        return country
     endpoint, key = random.choice(list(API_ENDPOINTS.items()))
     url = endpoint + ip_address
     if "ipapi.co" in endpoint:
         url += "/country"
     try:
-        async with httpx.AsyncClient(verify=False) as client:
-            resp = await client.get(url, timeout=2)
+        resp = await get_geoip_client().get(url, timeout=2)
         info = resp.json()
         country = info.get(key) if key else resp.text
         if country:
@@ -85,6 +150,24 @@ async def check_ip(ip_address: str) -> None | str:
         return None
 
 
+@lru_cache(maxsize=100_000)
+def is_public_ip(ip: str) -> bool:
+    """
+    Check if a string is a valid and public (not private) IP address.
+    The result is memoized, so each address is parsed only once.
+
+    Args:
+        ip (str): The string to check.
+
+    Returns:
+        bool: True if the string is a valid public IP address, False otherwise.
+    """
+    try:
+        return not ipaddress.ip_address(ip).is_private
+    except ValueError:
+        return False
+
+
 async def is_valid_ip(ip: str) -> bool:
     """
     Check if a string is a valid IP address.
@@ -97,73 +180,306 @@ async def is_valid_ip(ip: str) -> bool:
     Returns:
         bool: True if the string is a valid IP address, False otherwise.
     """
-    try:
-        ip_obj = ipaddress.ip_address(ip)
-        return not ip_obj.is_private
-    except ValueError:
+    return is_public_ip(ip)
+
+
+EMAIL_REGEX = re.compile(r"[A-Za-z0-9._%+-]+")
+
+
+def parse_line(line: str) -> LogRecord | None:
+    """
+    Parse an accepted connection line of the Xray access log in a single pass, like:
+    '2023/07/07 03:09:00 [from ]1.2.3.4:5678 accepted tcp:example.com:443 [in >> out] email: 1.user'
+
+    Only string methods are used (no regex search over the whole line),
+    the source address is always the token right before 'accepted'.
+
+    Args:
+        line (str): The log line.
+
+    Returns:
+        LogRecord | None: The fields of the line, or None if it is not an accepted connection.
+    """
+    head, sep, tail = line.partition(" accepted ")
+    if not sep:
+        return None
+    address, _, port = head[head.rfind(" ") + 1 :].rpartition(":")
+    if not (port.isascii() and port.isdigit()):
+        return None
+    if address[:4] in ("tcp:", "udp:"):
+        address = address[4:]
+    if address.startswith("["):
+        address = address[1:-1]
+    destination, _, rest = tail.partition(" ")
+    inbound = outbound = email = None
+    if rest.startswith("["):
+        route, _, rest = rest[1:].partition("]")
+        inbound, arrow, outbound = route.partition(" >> ")
+        if not arrow:
+            inbound, arrow, outbound = route.partition(" -> ")
+        if not arrow:
+            # like '[BLOCK]' (no inbound tag), the whole route is the outbound tag
+            inbound, outbound = None, route
+    _, sep, rest = rest.partition("email:")
+    if sep:
+        email_match = EMAIL_REGEX.match(rest.lstrip())
+        if email_match:
+            email = email_match.group()
+    return LogRecord(address, int(port), destination, inbound, outbound, email)
+
+
+def apply_config(snapshot: ConfigSnapshot) -> None:
+    """
+    Take the values the parser needs from a new config snapshot,
+    so parse_logs doesn't touch the config file for each log.
+
+    Args:
+        snapshot (ConfigSnapshot): The new config snapshot.
+    """
+    global IP_LOCATION
+    global CONFIG_INVALID_IPS
+    global INVALID_IPS
+    IP_LOCATION = snapshot.ip_location
+    CONFIG_INVALID_IPS = snapshot.invalid_ips
+    INVALID_IPS = DEFAULT_INVALID_IPS | CONFIG_INVALID_IPS | NODE_IPS
+
+
+def add_node_ip(ip: str) -> None:
+    """
+    Ignore the connections from a node address.
+
+    Args:
+        ip (str): The IP address of the node.
+    """
+    global INVALID_IPS
+    if ip not in NODE_IPS:
+        NODE_IPS.add(ip)
+        INVALID_IPS = DEFAULT_INVALID_IPS | CONFIG_INVALID_IPS | NODE_IPS
+
+
+subscribe_config(apply_config)
+
+
+def record_ip(email: str, ip: str, count: int = 1, now: float | None = None) -> None:
+    """
+    Add the connections of a user from an IP address to ACTIVE_USERS
+    (and to STATE_STORE, to be saved).
+    Each user keeps one counter per distinct IP inside the sliding window.
+
+    Args:
+        email (str): The username.
+        ip (str): The IP address.
+        count (int): The number of connections.
+        now (float | None): The time of the connections, the current time if None.
+    """
+    if now is None:
+        now = time.time()
+    ACTIVE_USERS.add(email, ip, count, now)
+    STATE_STORE.record_activity(email, ip, count, now)
+
+
+def save_country(ip: str, country: str | None, location: str) -> bool:
+    """
+    Save the location verdict of an IP address.
+
+    Args:
+        ip (str): The IP address.
+        country (str | None): The country code of the IP address, None if it is unknown.
+        location (str): The country set in 'IP_LOCATION'.
+
+    Returns:
+        bool: False if the IP belongs to another country and must be ignored.
+    """
+    if country and country == location:
+        VALID_IPS.add(ip)
+    elif country:
+        FOREIGN_IPS.add(ip)
         return False
+    return True
+
+
+class IPResolver:
+    """
+    Resolves the location of new IP addresses in the background,
+    so the log processing never waits for a GeoIP API.
+
+    The connections of an IP address are kept as pending until it is resolved,
+    and every IP is looked up only once even if it is seen again meanwhile.
+    """
+
+    def __init__(self, workers: int = 4, max_pending: int = 10_000):
+        """
+        Args:
+            workers (int): How many lookups run at the same time.
+            max_pending (int): The maximum number of IPs waiting for a lookup,
+            connections from new IPs are dropped when it is reached.
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending: dict[str, Counter] = {}
+        self.dropped = 0
+        self._queue: asyncio.Queue | None = None
 
+    @property
+    def running(self) -> bool:
+        """True if the resolver task is running."""
+        return self._queue is not None
 
-IP_V6_REGEX = re.compile(r"\[([0-9a-fA-F:]+)\]:\d+\s+accepted")
-IP_V4_REGEX = re.compile(r"(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})")
-EMAIL_REGEX = re.compile(r"email:\s*([A-Za-z0-9._%+-]+)")
+    def submit(self, ip: str, email: str, count: int = 1) -> None:
+        """
+        Record connections from an IP address whose location is not known yet.
 
+        Args:
+            ip (str): The IP address.
+            email (str): The username.
+            count (int): The number of connections.
+        """
+        hits = self.pending.get(ip)
+        if hits is not None:
+            hits[email] += count
+            return
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending[ip] = Counter({email: count})
+        if self._queue is not None:
+            self._queue.put_nowait(ip)
 
-async def parse_logs(log: str) -> dict[str, UserType] | dict:  # pylint: disable=too-many-branches
+    async def _worker(self) -> None:
+        while True:
+            ip = await self._queue.get()
+            try:
+                country = await check_ip(ip)
+                hits = self.pending.pop(ip, Counter())
+                if save_country(ip, country, IP_LOCATION):
+                    now = time.time()
+                    for email, count in hits.items():
+                        record_ip(email, ip, count, now)
+            except Exception as error:  # pylint: disable=broad-except
+                self.pending.pop(ip, None)
+                logger.error("Failed to resolve %s: %s", ip, error)
+            finally:
+                self._queue.task_done()
+
+    async def run(self) -> None:
+        """Run the lookup workers."""
+        self._queue = asyncio.Queue()
+        for ip in self.pending:
+            self._queue.put_nowait(ip)
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(self.workers):
+                    tg.create_task(self._worker())
+        finally:
+            self._queue = None
+
+
+IP_RESOLVER = IPResolver()
+
+
+def count_connections(log: str) -> Counter:
     """
-    Asynchronously parse logs to extract and validate IP addresses and emails.
+    Count the accepted connections of each user and IP address in a log.
+    Lines that are never counted (other lines, blocked connections,
+    invalid emails and private addresses) are skipped here.
+    It doesn't need the config, so it also runs in the ingest workers.
 
     Args:
         log (str): The log to parse.
 
     Returns:
-        list[UserType]
+        Counter: (email, ip) -> the number of connections.
     """
-    data = await read_config()
-    if data.get("INVALID_IPS"):
-        INVALID_IPS.update(data.get("INVALID_IPS"))
-    lines = log.splitlines()
-    for line in lines:
+    counts = Counter()
+    for line in log.splitlines():
         if "accepted" not in line:
             continue
-        if "BLOCK]" in line:
+        record = parse_line(line)
+        if record is None or record.email is None:
+            continue
+        if record.outbound and record.outbound.endswith("BLOCK"):
             continue
-        ip_v6_match = IP_V6_REGEX.search(line)
-        ip_v4_match = IP_V4_REGEX.search(line)
-        email_match = EMAIL_REGEX.search(line)
-        if ip_v6_match:
-            ip = ip_v6_match.group(1)
-        elif ip_v4_match:
-            ip = ip_v4_match.group(1)
-        else:
+        email = strip_user_id(record.email)
+        if email in INVALID_EMAILS:
             continue
+        if is_public_ip(record.ip):
+            counts[email, record.ip] += 1
+    return counts
+
+
+async def record_connections(counts, now: float | None = None) -> None:
+    """
+    Validate the IP addresses of counted connections and add them to ACTIVE_USERS.
+    IPs with an unknown location are passed to IP_RESOLVER (if it is running).
+
+    Args:
+        counts (Mapping): (email, ip) -> the number of connections.
+        now (float | None): The time of the connections, the current time if None.
+    """
+    if IP_LOCATION is None:
+        await refresh_config()
+    if now is None:
+        now = time.time()
+    for (email, ip), count in counts.items():
         if ip not in VALID_IPS:
-            is_valid_ip_test = await is_valid_ip(ip)
-            if is_valid_ip_test and ip not in INVALID_IPS:
-                if data["IP_LOCATION"] != "None":
-                    country = await check_ip(ip)
-                    if country and country == data["IP_LOCATION"]:
-                        VALID_IPS.append(ip)
-                    elif country and country != data["IP_LOCATION"]:
-                        INVALID_IPS.add(ip)
-                        continue
-            else:
-                continue
-        if email_match:
-            email = email_match.group(1)
-            email = await remove_id_from_username(email)
-            if email in INVALID_EMAILS:
+            if ip in INVALID_IPS or ip in FOREIGN_IPS:
                 continue
-        else:
-            continue
+            if IP_LOCATION != "None":
+                country = local_country(ip)
+                if country is None and IP_RESOLVER.running:
+                    IP_RESOLVER.submit(ip, email, count)
+                    continue
+                if country is None:
+                    country = await check_ip(ip)
+                if not save_country(ip, country, IP_LOCATION):
+                    continue
+        record_ip(email, ip, count, now)
+
 
-        user = ACTIVE_USERS.get(email)
-        if user:
-            user.ip.append(ip)
-        else:
-            user = ACTIVE_USERS.setdefault(
-                email,
-                UserType(name=email, ip=[ip]),
-            )
+async def parse_logs(log: str) -> IpTracker:
+    """
+    Asynchronously parse logs to extract and validate IP addresses and emails.
+    IPs with an unknown location are passed to IP_RESOLVER (if it is running).
 
+    Args:
+        log (str): The log to parse.
+
+    Returns:
+        IpTracker: ACTIVE_USERS
+    """
+    await record_connections(count_connections(log))
     return ACTIVE_USERS
+
+
+async def run_parse_logs() -> None:
+    """
+    Parse the logs put in LOG_QUEUE by the websocket tasks.
+    Until this task runs, queue_logs() parses the logs directly.
+    """
+    global LOG_QUEUE
+    LOG_QUEUE = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+    try:
+        while True:
+            log = await LOG_QUEUE.get()
+            try:
+                await parse_logs(log)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Failed to parse logs: %s", error)
+            finally:
+                LOG_QUEUE.task_done()
+    finally:
+        LOG_QUEUE = None
+
+
+async def queue_logs(log: str) -> None:
+    """
+    Pass a received log to the processing task.
+    Waits if the queue is full, so memory use stays bounded.
+
+    Args:
+        log (str): The log to parse.
+    """
+    if LOG_QUEUE is None:
+        await parse_logs(log)
+        return
+    await LOG_QUEUE.put(log)
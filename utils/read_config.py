@@ -1,15 +1,80 @@
 """
 Read config file and return data.
 """
+
 # pylint: disable=global-statement
 
+import asyncio
+import copy
+import hashlib
 import json
 import os
 import sys
-import time
+from types import MappingProxyType
+from typing import Callable
+
+from utils.inotify import open_inotify
+from utils.logs import logger
+from utils.types import ConfigSnapshot, LimitIndex
 
+CONFIG_FILE = "config.json"
 CONFIG_DATA = None
-LAST_READ_TIME = 0
+# (mtime in ns, size, inode) of the config file when it was last read
+CONFIG_STAT: tuple[int, int, int] | None = None
+CONFIG_HASH: bytes | None = None
+# True while watch_config() runs, then read_config() doesn't check the file itself
+CONFIG_WATCHED = False
+CONFIG_SNAPSHOT: ConfigSnapshot | None = None
+# the CONFIG_DATA object the current snapshot was made from
+SNAPSHOT_SOURCE = None
+CONFIG_SUBSCRIBERS: list[Callable[[ConfigSnapshot], None]] = []
+CONFIG_WATCH_INTERVAL = 5
+# with inotify the file is still checked this often, in case an event is missed
+CONFIG_RECHECK_INTERVAL = 60
+
+
+def load_config_file(exit_on_error: bool = True) -> bool:
+    """
+    Read the config file if it changed since the last read.
+    The file is only parsed if its content hash changed, so CONFIG_DATA keeps
+    the same object (and no new snapshot is published) if only the mtime changed.
+
+    Args:
+        exit_on_error (bool): Exit if the file is invalid, else keep the old data.
+
+    Returns:
+        bool: True if CONFIG_DATA was replaced.
+    """
+    global CONFIG_DATA
+    global CONFIG_STAT
+    global CONFIG_HASH
+    stat = os.stat(CONFIG_FILE)
+    signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    if CONFIG_DATA is not None and signature == CONFIG_STAT:
+        return False
+    with open(CONFIG_FILE, "rb") as f:
+        content = f.read()
+    digest = hashlib.blake2b(content, digest_size=16).digest()
+    CONFIG_STAT = signature
+    if CONFIG_DATA is not None and digest == CONFIG_HASH:
+        return False
+    try:
+        data = json.loads(content)
+    except (json.JSONDecodeError, UnicodeDecodeError) as error:
+        if not exit_on_error and CONFIG_DATA is not None:
+            logger.error("Invalid config.json, the old config is kept: %s", error)
+            return False
+        print("Error decoding the config.json file. Please check its syntax.", error)
+        sys.exit()
+    if "BOT_TOKEN" not in data:
+        print("BOT_TOKEN is not set in the config.json file.")
+        sys.exit()
+    if "ADMINS" not in data:
+        print("ADMINS is not set in the config.json file.")
+        sys.exit()
+    CONFIG_DATA = data
+    CONFIG_HASH = digest
+    return True
 
 
 async def read_config(
@@ -17,31 +82,15 @@ async def read_config(
 ) -> dict:
     """
     read and return data from a JSON file.
+    While watch_config() runs the cached data is returned without touching the file.
     """
-    global CONFIG_DATA
-    global LAST_READ_TIME
-    config_file = "config.json"
+    config_file = CONFIG_FILE
 
-    if not os.path.exists(config_file):
-        print("Config file not found.")
-        sys.exit()
-    file_mod_time = os.path.getmtime(config_file)
-    if CONFIG_DATA is None or file_mod_time > LAST_READ_TIME:
-        try:
-            with open(config_file, "r", encoding="utf-8") as f:
-                CONFIG_DATA = json.load(f)
-        except json.JSONDecodeError as error:
-            print(
-                "Error decoding the config.json file. Please check its syntax.", error
-            )
-            sys.exit()
-        if "BOT_TOKEN" not in CONFIG_DATA:
-            print("BOT_TOKEN is not set in the config.json file.")
-            sys.exit()
-        if "ADMINS" not in CONFIG_DATA:
-            print("ADMINS is not set in the config.json file.")
+    if CONFIG_DATA is None or CONFIG_STAT is None or not CONFIG_WATCHED:
+        if not os.path.exists(config_file):
+            print("Config file not found.")
             sys.exit()
-        LAST_READ_TIME = time.time()
+        load_config_file()
     if check_required_elements:
         required_elements = [
             "PANEL_DOMAIN",
@@ -58,3 +107,121 @@ async def read_config(
                     f"Missing required element '{element}' in the config file."
                 )
     return CONFIG_DATA
+
+
+def cached_config() -> dict | None:
+    """Return the config data read last, None if it was not read yet."""
+    return CONFIG_DATA
+
+
+def invalidate_config() -> None:
+    """
+    Make the next read_config() check the config file again.
+    Called after the file is written by this program.
+    """
+    global CONFIG_STAT
+    CONFIG_STAT = None
+
+
+def make_snapshot(data: dict, version: int) -> ConfigSnapshot:
+    """
+    Build an immutable snapshot from the config data.
+
+    Args:
+        data (dict): The config data.
+        version (int): The version number of the snapshot.
+
+    Returns:
+        ConfigSnapshot: The snapshot.
+    """
+    return ConfigSnapshot(
+        version=version,
+        data=MappingProxyType(copy.deepcopy(data)),
+        invalid_ips=frozenset(data.get("INVALID_IPS") or []),
+        ip_location=str(data.get("IP_LOCATION", "None")),
+        limits=LimitIndex.from_config(data),
+    )
+
+
+def subscribe_config(callback: Callable[[ConfigSnapshot], None]) -> None:
+    """
+    Register a function that is called with each new config snapshot.
+    If a snapshot is already published, the function is called with it right away.
+
+    Args:
+        callback (Callable[[ConfigSnapshot], None]): The function to call.
+    """
+    CONFIG_SUBSCRIBERS.append(callback)
+    if CONFIG_SNAPSHOT is not None:
+        callback(CONFIG_SNAPSHOT)
+
+
+def publish_config(data: dict) -> ConfigSnapshot:
+    """
+    Publish a new snapshot of the config data to all subscribers.
+
+    Args:
+        data (dict): The config data.
+
+    Returns:
+        ConfigSnapshot: The published snapshot.
+    """
+    global CONFIG_SNAPSHOT
+    version = CONFIG_SNAPSHOT.version + 1 if CONFIG_SNAPSHOT else 1
+    CONFIG_SNAPSHOT = make_snapshot(data, version)
+    for callback in CONFIG_SUBSCRIBERS:
+        callback(CONFIG_SNAPSHOT)
+    return CONFIG_SNAPSHOT
+
+
+async def refresh_config() -> ConfigSnapshot:
+    """
+    Read the config file and publish a new snapshot if it changed.
+
+    Returns:
+        ConfigSnapshot: The current snapshot.
+    """
+    global SNAPSHOT_SOURCE
+    data = await read_config()
+    if CONFIG_SNAPSHOT is None or data is not SNAPSHOT_SOURCE:
+        SNAPSHOT_SOURCE = data
+        return publish_config(data)
+    return CONFIG_SNAPSHOT
+
+
+async def watch_config() -> None:
+    """
+    Publish a new snapshot whenever the config file changes,
+    the only task that needs to touch the file for the subscribers.
+    On Linux it waits for inotify events, else it checks the file
+    every 'CONFIG_WATCH_INTERVAL' seconds.
+    """
+    global CONFIG_WATCHED
+    await refresh_config()
+    directory = os.path.dirname(os.path.abspath(CONFIG_FILE))
+    watcher = open_inotify(directory)
+    if watcher is None:
+        logger.info("inotify is not available, polling the config file")
+    CONFIG_WATCHED = True
+    try:
+        while True:
+            if watcher is None:
+                await asyncio.sleep(CONFIG_WATCH_INTERVAL)
+            else:
+                try:
+                    await asyncio.wait_for(
+                        watcher.wait(os.path.basename(CONFIG_FILE)),
+                        CONFIG_RECHECK_INTERVAL,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                load_config_file(exit_on_error=False)
+            except OSError as error:
+                logger.error("Failed to read the config file: %s", error)
+                continue
+            await refresh_config()
+    finally:
+        CONFIG_WATCHED = False
+        if watcher is not None:
+            watcher.close()
@@ -0,0 +1,256 @@
+"""
+This module keeps the state of the program in a SQLite file (in WAL mode):
+the connections of the users per IP, the disable history and the GeoIP cache.
+Changes are buffered in memory and written in one transaction by a background task,
+so a restart starts with the recent activity and the history can be queried later.
+"""
+
+import asyncio
+import sqlite3
+import time
+from collections import Counter
+
+from utils.logs import logger
+
+STATE_FILE = ".v2iplimit.db"
+# the connections are saved per IP in buckets of this many seconds
+HISTORY_BUCKET = 10
+HISTORY_RETENTION = 7 * 86400
+# older connections (long past the IP window) are merged into buckets of this many seconds
+HISTORY_COARSE_BUCKET = 300
+COARSEN_AFTER = 3600
+FLUSH_INTERVAL = 5
+PRUNE_INTERVAL = 3600
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS geoip "
+    + "(ip TEXT PRIMARY KEY, country TEXT NOT NULL, expires_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS ip_activity (email TEXT NOT NULL, ip TEXT NOT NULL,"
+    + " bucket INTEGER NOT NULL, hits INTEGER NOT NULL,"
+    + " PRIMARY KEY (email, ip, bucket)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS ip_activity_bucket ON ip_activity (bucket)",
+    "CREATE TABLE IF NOT EXISTS disable_history (id INTEGER PRIMARY KEY,"
+    + " email TEXT NOT NULL, disabled_at REAL NOT NULL, enable_at REAL NOT NULL,"
+    + " offences INTEGER NOT NULL, enabled_at REAL)",
+    "CREATE INDEX IF NOT EXISTS disable_history_email ON disable_history (email)",
+)
+
+
+def connect(filename: str = STATE_FILE, **kwargs) -> sqlite3.Connection:
+    """
+    Open the state file in WAL mode and create the tables if they don't exist.
+
+    Args:
+        filename (str): The SQLite file.
+        **kwargs: Passed to sqlite3.connect().
+
+    Returns:
+        sqlite3.Connection: The connection.
+    """
+    connection = sqlite3.connect(filename, **kwargs)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    with connection:
+        for statement in SCHEMA:
+            connection.execute(statement)
+    return connection
+
+
+class StateStore:
+    """
+    Buffers the state changes and writes them to the state file in batches.
+
+    The record_* methods only update memory, run() writes everything that was
+    recorded since the last write every 'FLUSH_INTERVAL' seconds.
+    """
+
+    def __init__(self, filename: str = STATE_FILE):
+        self.filename = filename
+        # (email, ip, bucket) -> connections
+        self._activity: Counter[tuple[str, str, int]] = Counter()
+        self._disables: list[tuple[str, float, float, int]] = []
+        self._enables: list[tuple[float, str]] = []
+        self._connection: sqlite3.Connection | None = None
+        self._last_prune = 0.0
+
+    def record_activity(
+        self, email: str, ip: str, count: int = 1, now: float | None = None
+    ) -> None:
+        """
+        Record connections of a user from an IP address.
+
+        Args:
+            email (str): The username.
+            ip (str): The IP address.
+            count (int): The number of connections.
+            now (float | None): The time of the connections, the current time if None.
+        """
+        if now is None:
+            now = time.time()
+        self._activity[email, ip, int(now // HISTORY_BUCKET)] += count
+
+    def record_disable(
+        self, email: str, disabled_at: float, enable_at: float, offences: int
+    ) -> None:
+        """
+        Record that a user was disabled.
+
+        Args:
+            email (str): The username.
+            disabled_at (float): When it was disabled (unix time).
+            enable_at (float): When it should be enabled (unix time).
+            offences (int): The number of recent offences of the user.
+        """
+        self._disables.append((email, disabled_at, enable_at, offences))
+
+    def record_enable(self, emails, enabled_at: float | None = None) -> None:
+        """
+        Record that users were enabled again.
+
+        Args:
+            emails (Iterable[str]): The usernames.
+            enabled_at (float | None): When they were enabled, the current time if None.
+        """
+        enabled_at = time.time() if enabled_at is None else enabled_at
+        self._enables.extend((enabled_at, email) for email in emails)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # only one write runs at a time, but it can be on any worker thread
+            self._connection = connect(self.filename, check_same_thread=False)
+        return self._connection
+
+    def _write(self, activity, disables, enables, prune_before: int | None) -> None:
+        """Write one batch in a single transaction."""
+        connection = self._get_connection()
+        with connection:
+            connection.executemany(
+                "INSERT INTO ip_activity (email, ip, bucket, hits) VALUES (?, ?, ?, ?)"
+                + " ON CONFLICT (email, ip, bucket) DO UPDATE"
+                + " SET hits = hits + excluded.hits",
+                [(*key, hits) for key, hits in activity.items()],
+            )
+            connection.executemany(
+                "INSERT INTO disable_history (email, disabled_at, enable_at, offences)"
+                + " VALUES (?, ?, ?, ?)",
+                disables,
+            )
+            connection.executemany(
+                "UPDATE disable_history SET enabled_at = ?"
+                + " WHERE email = ? AND enabled_at IS NULL",
+                enables,
+            )
+            if prune_before is not None:
+                self._coarsen(connection)
+                connection.execute(
+                    "DELETE FROM ip_activity WHERE bucket < ?", (prune_before,)
+                )
+                connection.execute(
+                    "DELETE FROM disable_history"
+                    + " WHERE enabled_at IS NOT NULL AND enabled_at < ?",
+                    (prune_before * HISTORY_BUCKET,),
+                )
+
+    @staticmethod
+    def _coarsen(connection: sqlite3.Connection) -> None:
+        """
+        Merge the connections older than 'COARSEN_AFTER' seconds
+        into buckets of 'HISTORY_COARSE_BUCKET' seconds.
+        A merged row keeps the number of its first bucket.
+        """
+        size = HISTORY_COARSE_BUCKET // HISTORY_BUCKET
+        before = int((time.time() - COARSEN_AFTER) // HISTORY_BUCKET)
+        before -= before % size
+        connection.execute(
+            "INSERT INTO ip_activity (email, ip, bucket, hits)"
+            + " SELECT email, ip, bucket - bucket % ?, SUM(hits) FROM ip_activity"
+            + " WHERE bucket < ? AND bucket % ? != 0 GROUP BY 1, 2, 3"
+            + " ON CONFLICT (email, ip, bucket) DO UPDATE"
+            + " SET hits = hits + excluded.hits",
+            (size, before, size),
+        )
+        connection.execute(
+            "DELETE FROM ip_activity WHERE bucket < ? AND bucket % ? != 0",
+            (before, size),
+        )
+
+    async def flush(self) -> None:
+        """Write everything recorded since the last write."""
+        activity, self._activity = self._activity, Counter()
+        disables, self._disables = self._disables, []
+        enables, self._enables = self._enables, []
+        now = time.time()
+        prune_before = None
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self._last_prune = now
+            prune_before = int((now - HISTORY_RETENTION) // HISTORY_BUCKET)
+        if not (activity or disables or enables or prune_before):
+            return
+        try:
+            await asyncio.to_thread(
+                self._write, activity, disables, enables, prune_before
+            )
+        except sqlite3.Error as error:
+            logger.error("Failed to write %s: %s", self.filename, error)
+
+    async def run(self) -> None:
+        """Write the recorded changes every 'FLUSH_INTERVAL' seconds."""
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+    def load_activity(self, since: float) -> list[tuple[str, str, float, int]]:
+        """
+        Return the saved connections since a time, oldest first.
+
+        Args:
+            since (float): The unix time to start from.
+
+        Returns:
+            list[tuple[str, str, float, int]]: (email, ip, time, connections) tuples,
+            the time is the end of the bucket.
+        """
+        rows = (
+            self._get_connection()
+            .execute(
+                "SELECT email, ip, bucket, hits FROM ip_activity"
+                + " WHERE bucket >= ? ORDER BY bucket",
+                (int(since // HISTORY_BUCKET),),
+            )
+            .fetchall()
+        )
+        now = time.time()
+        return [
+            (email, ip, min((bucket + 1) * HISTORY_BUCKET, now), hits)
+            for email, ip, bucket, hits in rows
+        ]
+
+    async def load_tracker(self, tracker) -> None:
+        """
+        Fill an IpTracker with the connections saved inside its window.
+        The tracker is cleared first: the saved connections include the ones
+        it already has if the program was restarted in the same process.
+
+        Args:
+            tracker (IpTracker): The tracker to fill.
+        """
+        try:
+            rows = await asyncio.to_thread(
+                self.load_activity, time.time() - tracker.window
+            )
+        except sqlite3.Error as error:
+            logger.error("Failed to read %s: %s", self.filename, error)
+            return
+        tracker.clear()
+        for email, ip, seen_at, hits in rows:
+            tracker.add(email, ip, hits, seen_at)
+        logger.info("Loaded %s saved IP activity entries", len(rows))
+
+    def close(self) -> None:
+        """Close the connection to the state file."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+STATE_STORE = StateStore()
@@ -0,0 +1,133 @@
+"""
+This module contains the TTLCache class,
+a size-bounded LRU mapping whose entries expire after a fixed time.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+class TTLCache:
+    """
+    A hashed mapping with a size cap (least recently used entries are evicted first)
+    and a per-entry time to live.
+
+    Attributes:
+        maxsize (int): The maximum number of entries.
+        ttl (float): Seconds an entry stays valid after it is set.
+        hits (int): Lookups that found a live entry.
+        misses (int): Lookups that found nothing (or an expired entry).
+        evictions (int): Entries removed because the cache was full.
+        expirations (int): Entries removed because they were too old.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+
+    def _lookup(self, key: Any) -> tuple[bool, Any]:
+        """Find a live entry, count the hit or miss and refresh its LRU position."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return False, None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return True, value
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Return the value for key if it is cached and not expired, else default."""
+        found, value = self._lookup(key)
+        return value if found else default
+
+    def __contains__(self, key: Any) -> bool:
+        return self._lookup(key)[0]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self.set(key, value)
+
+    def set(self, key: Any, value: Any, ttl: float | None = None) -> None:
+        """
+        Set a value, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (Any): The key.
+            value (Any): The value.
+            ttl (float | None): Time to live for this entry, the cache ttl if None.
+        """
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def add(self, key: Any) -> None:
+        """Add a key, so the cache can be used like a set."""
+        self.set(key, True)
+
+    def discard(self, key: Any) -> None:
+        """Remove a key if it is present."""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all entries (the counters are kept)."""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def dump(self) -> list[tuple[Any, Any, float]]:
+        """
+        Return the live entries from least to most recently used.
+
+        Returns:
+            list[tuple[Any, Any, float]]: (key, value, expiry as a unix timestamp) tuples.
+        """
+        now = time.monotonic()
+        offset = time.time() - now
+        return [
+            (key, value, expires_at + offset)
+            for key, (value, expires_at) in self._data.items()
+            if expires_at > now
+        ]
+
+    def load(self, entries: list[tuple[Any, Any, float]]) -> int:
+        """
+        Add entries returned by dump() (possibly from an earlier run).
+
+        Args:
+            entries (list[tuple[Any, Any, float]]): (key, value, unix expiry) tuples,
+            from least to most recently used.
+
+        Returns:
+            int: The number of entries that were still valid and added.
+        """
+        now = time.time()
+        loaded = 0
+        for key, value, expires_at in entries:
+            if expires_at > now:
+                self.set(key, value, ttl=min(expires_at - now, self.ttl))
+                loaded += 1
+        return loaded
+
+    def stats(self) -> dict[str, int]:
+        """Return the size and the hit/miss/eviction/expiration counters."""
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -4,6 +4,8 @@ This module contains the data classes used in the application.
 
 from dataclasses import dataclass, field
 from enum import Enum
+from types import MappingProxyType
+from typing import NamedTuple
 
 
 @dataclass
@@ -57,6 +59,72 @@ class UserStatus(Enum):
     DISABLE = "DISABLE"
 
 
+class StreamState(Enum):
+    """
+    Enum representing the state of a log stream.
+
+    Attributes:
+        CONNECTING (str): Opening the websocket.
+        STREAMING (str): Connected and receiving logs.
+        BACKOFF (str): Waiting before the next try after a failure.
+        DEAD (str): Failed many times in a row, retried at the longest delay.
+    """
+
+    CONNECTING = "connecting"
+    STREAMING = "streaming"
+    BACKOFF = "backoff"
+    DEAD = "dead"
+
+
+class NodeEventKind(Enum):
+    """
+    Enum representing how a node changed between two polls of the panel.
+
+    Attributes:
+        ADDED (str): The node is new.
+        REMOVED (str): The node was deleted from the panel.
+        STATUS_CHANGED (str): The status of the node changed.
+        CHANGED (str): The name, address or message of the node changed.
+    """
+
+    ADDED = "added"
+    REMOVED = "removed"
+    STATUS_CHANGED = "status_changed"
+    CHANGED = "changed"
+
+
+@dataclass(frozen=True)
+class NodeEvent:
+    """
+    A change of a node seen by the node inventory.
+
+    Attributes:
+        kind (NodeEventKind): What changed.
+        node (NodeType): The node now (the last known node if it was removed).
+        previous (NodeType | None): The node before, None if it was added.
+        initial (bool): True for the nodes of the first poll.
+    """
+
+    kind: NodeEventKind
+    node: NodeType
+    previous: NodeType | None = None
+    initial: bool = False
+
+
+@dataclass(slots=True)
+class IpActivity:
+    """
+    The connections of a user from one IP address.
+
+    Attributes:
+        count (int): The number of connections.
+        last_seen (float): The time of the last connection (unix timestamp).
+    """
+
+    count: int = 0
+    last_seen: float = 0.0
+
+
 @dataclass
 class UserType:
     """
@@ -65,9 +133,101 @@ class UserType:
     Attributes:
         name (str): The name of the user.
         status (str | None): The status of the user. None if no status is provided.
-        ip (list[str] | list): List of IP address of the user.
+        ip (dict[str, IpActivity]): The IP addresses of the user and their connections.
     """
 
     name: str
     status: UserStatus | None = None
-    ip: list[str] | list = field(default_factory=list)
+    ip: dict[str, IpActivity] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class LimitIndex:
+    """
+    The IP limits of the users, built once each time the config changes.
+
+    Attributes:
+        exceptions (frozenset[str]): The 'EXCEPT_USERS' of the config (no limit).
+        special (dict[str, int]): The 'SPECIAL_LIMIT' of the config.
+        general (int | None): The 'GENERAL_LIMIT' of the config, None if it is not set.
+    """
+
+    exceptions: frozenset[str] = frozenset()
+    special: dict[str, int] = field(default_factory=dict)
+    general: int | None = None
+
+    @classmethod
+    def from_config(cls, data: dict) -> "LimitIndex":
+        """
+        Build the index from the config data.
+
+        Args:
+            data (dict): The config data.
+
+        Returns:
+            LimitIndex: The index.
+        """
+        general = data.get("GENERAL_LIMIT")
+        return cls(
+            exceptions=frozenset(data.get("EXCEPT_USERS") or []),
+            special={
+                name: int(limit)
+                for name, limit in (data.get("SPECIAL_LIMIT") or {}).items()
+            },
+            general=None if general is None else int(general),
+        )
+
+    def limit(self, user_name: str) -> int | None:
+        """
+        Return the number of active IPs a user is allowed to have.
+
+        Args:
+            user_name (str): The username.
+
+        Returns:
+            int | None: The limit, None if the user has no limit.
+        """
+        if user_name in self.exceptions:
+            return None
+        return self.special.get(user_name, self.general)
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    An immutable view of the config file, published when the file changes.
+
+    Attributes:
+        version (int): Increases each time a new snapshot is published.
+        data (MappingProxyType): A read-only copy of the config data.
+        invalid_ips (frozenset[str]): The 'INVALID_IPS' list of the config.
+        ip_location (str): The 'IP_LOCATION' country code ("None" to not check it).
+        limits (LimitIndex): The IP limits of the users.
+    """
+
+    version: int
+    data: MappingProxyType
+    invalid_ips: frozenset[str] = frozenset()
+    ip_location: str = "None"
+    limits: LimitIndex = field(default_factory=LimitIndex)
+
+
+class LogRecord(NamedTuple):
+    """
+    The fields of one accepted connection line of the Xray access log.
+
+    Attributes:
+        ip (str): The source IP address of the client.
+        port (int): The source port of the client.
+        destination (str): The requested destination (like 'tcp:example.com:443').
+        inbound (str | None): The inbound tag.
+        outbound (str | None): The outbound tag (the route).
+        email (str | None): The email (username) of the user.
+    """
+
+    ip: str
+    port: int
+    destination: str
+    inbound: str | None
+    outbound: str | None
+    email: str | None
@@ -8,24 +8,24 @@ import asyncio
 import time
 
 from run_telegram import run_telegram_bot
-from telegram_bot.send_message import send_logs
-from utils.check_usage import run_check_users_usage
-from utils.get_logs import (
-    TASKS,
-    check_and_add_new_nodes,
-    create_node_task,
-    create_panel_task,
-    handle_cancel,
-    handle_cancel_all,
+from telegram_bot.send_message import DISPATCHER, send_logs
+from utils.check_usage import ACTIVE_USERS, ENFORCER, run_check_users_usage
+from utils.geoip_cache import (
+    load_geoip_cache,
+    run_save_geoip_cache,
+    save_geoip_cache,
 )
-from utils.handel_dis_users import DisabledUsers
+from utils.geoip_database import load_geoip_database
+from utils.get_logs import create_panel_task, handle_node_events, monitor_streams
+from utils.handel_dis_users import get_disabled_users
+from utils.http_client import close_clients, start_clients
+from utils.ingest_workers import DEFAULT_INGEST_WORKERS, IngestPool
 from utils.logs import logger
-from utils.panel_api import (
-    enable_dis_user,
-    enable_selected_users,
-    get_nodes,
-)
-from utils.read_config import read_config
+from utils.node_inventory import NODE_INVENTORY
+from utils.panel_api import PANEL_SCHEME, enable_dis_user
+from utils.parse_logs import CACHE, IP_RESOLVER, run_parse_logs
+from utils.read_config import read_config, refresh_config, watch_config
+from utils.state_store import STATE_STORE
 from utils.types import PanelType
 
 VERSION = "1.0.6"
@@ -34,8 +34,6 @@ parser = argparse.ArgumentParser(description="Help message")
 parser.add_argument("--version", action="version", version=VERSION)
 args = parser.parse_args()
 
-dis_obj = DisabledUsers()
-
 
 async def main():
     """Main function to run the code."""
@@ -66,39 +64,58 @@ async def main():
         config_file["PANEL_PASSWORD"],
         config_file["PANEL_DOMAIN"],
     )
-    dis_users = await dis_obj.read_and_clear_users()
-    await enable_selected_users(panel_data, dis_users)
-    await get_nodes(panel_data)
-    async with asyncio.TaskGroup() as tg:
-        print("Start Create Panel Task Test: ")
-        await create_panel_task(panel_data, tg)
-        await asyncio.sleep(5)
-        nodes_list = await get_nodes(panel_data)
-        if nodes_list and not isinstance(nodes_list, ValueError):
-            print("Start Create Nodes Task Test: ")
-            for node in nodes_list:
-                if node.status == "connected":
-                    await create_node_task(panel_data, tg, node)
-                    await asyncio.sleep(4)
-        print("Start 'check_and_add_new_nodes' Task Test: ")
-        tg.create_task(
-            check_and_add_new_nodes(panel_data, tg),
-            name="add_new_nodes",
-        )
-        print("Start 'handle_cancel' Task Test: ")
-        tg.create_task(
-            handle_cancel(panel_data, TASKS),
-            name="cancel_disable_nodes",
-        )
-        tg.create_task(
-            handle_cancel_all(TASKS, panel_data),
-            name="cancel_all",
-        )
-        tg.create_task(
-            enable_dis_user(panel_data),
-            name="enable_dis_user",
-        )
-        await run_check_users_usage(panel_data)
+    await start_clients()
+    await load_geoip_cache(CACHE)
+    await load_geoip_database(config_file)
+    # load '.disable_users.json', the users that are due are enabled by enable_dis_user
+    get_disabled_users()
+    # the window length of ACTIVE_USERS comes from the config
+    await refresh_config()
+    await STATE_STORE.load_tracker(ACTIVE_USERS)
+    try:
+        await PANEL_SCHEME.discover(panel_data)
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(DISPATCHER.run(), name="notifications")
+            tg.create_task(watch_config(), name="watch_config")
+            tg.create_task(run_parse_logs(), name="parse_logs")
+            tg.create_task(IP_RESOLVER.run(), name="ip_resolver")
+            tg.create_task(ENFORCER.run(panel_data), name="enforcer")
+            tg.create_task(STATE_STORE.run(), name="state_store")
+            print("Start Create Panel Task Test: ")
+            await create_panel_task(panel_data, tg)
+            ingest_pool = None
+            workers = int(config_file.get("INGEST_WORKERS", DEFAULT_INGEST_WORKERS))
+            if workers > 0:
+                ingest_pool = IngestPool(workers)
+                tg.create_task(ingest_pool.run(panel_data), name="ingest_workers")
+            # subscribe to the node inventory before its first poll
+            tg.create_task(
+                handle_node_events(panel_data, tg, ingest_pool),
+                name="node_streams",
+            )
+            tg.create_task(
+                NODE_INVENTORY.run(panel_data),
+                name="node_inventory",
+            )
+            tg.create_task(
+                monitor_streams(),
+                name="monitor_streams",
+            )
+            tg.create_task(
+                enable_dis_user(panel_data),
+                name="enable_dis_user",
+            )
+            tg.create_task(
+                run_save_geoip_cache(CACHE),
+                name="save_geoip_cache",
+            )
+            await run_check_users_usage(panel_data)
+
+    finally:
+        await save_geoip_cache(CACHE)
+        await STATE_STORE.flush()
+        STATE_STORE.close()
+        await close_clients()
 
 
 if __name__ == "__main__":